@@ -0,0 +1,119 @@
+"""
+Time the phases of `dplace makecldf` and `dplace check` on a synthetic dataset and compare the
+timings with stored baselines.
+
+    python benchmarks/bench.py --size medium
+    python benchmarks/bench.py --size medium --update  # Store the timings as new baselines.
+
+The exit code is non-zero if any phase is slower than its baseline by more than the tolerance.
+"""
+import os
+import sys
+import time
+import logging
+import pathlib
+import argparse
+import tempfile
+import contextlib
+
+from clldutils import jsonlib
+from cldfbench.dataset import dataset_from_module
+
+from synthetic import SIZES, make_dataset
+
+HERE = pathlib.Path(__file__).parent
+BASELINES = HERE / 'baselines.json'
+GLOTTOLOG = HERE.parent / 'tests' / 'gl_repos'
+
+
+@contextlib.contextmanager
+def timed(timings, phase):
+    start = time.perf_counter()
+    yield
+    timings[phase] = time.perf_counter() - start
+
+
+def run(d, sizes, workers=1):
+    from pydplace.__main__ import main
+    from pydplace.bibindex import BibIndex
+    from pydplace.dataset import read_parameters, iter_value_batches
+    from pydplace.geo import get_regions
+    from pydplace.validation import Validator
+
+    timings = {}
+    with timed(timings, 'generate'):
+        module = make_dataset(d, **sizes)
+    ds = dataset_from_module(module)
+
+    # The phases of makecldf, run in isolation:
+    with timed(timings, 'makecldf: parameters'):
+        _, _, codes = read_parameters(ds.raw_dir)
+    keys = set()
+    with timed(timings, 'makecldf: values'):
+        for batch_keys, _ in iter_value_batches(ds.raw_dir, codes, workers=workers):
+            keys.update(batch_keys)
+    with timed(timings, 'makecldf: sources'):
+        bib = BibIndex(ds.raw_dir / 'sources.bib')
+        for key in keys:
+            _ = bib[key]
+    societies = list(ds.raw_dir.read_csv('societies.csv', dicts=True))
+    with timed(timings, 'makecldf: regions'):
+        get_regions().match_many([r['Long'] for r in societies], [r['Lat'] for r in societies])
+
+    log = logging.getLogger('bench')
+    with timed(timings, 'makecldf'):
+        main([
+            'makecldf', str(module), '--glottolog', str(GLOTTOLOG), '--no-region-cache',
+            '--workers', str(workers)], log=log)
+
+    validator = Validator(ds)
+    with timed(timings, 'check'):
+        passed = validator()
+    assert passed, validator.errors[:10]
+    timings.update(('check: {}'.format(k), v) for k, v in validator.timings.items())
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--size', choices=list(SIZES), default='small')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument(
+        '--tolerance',
+        help="Factor by which a phase may be slower than the baseline",
+        type=float,
+        default=1.5)
+    parser.add_argument(
+        '--min-diff',
+        help="Differences of less seconds are never reported as regression",
+        type=float,
+        default=0.2)
+    parser.add_argument('--update', action='store_true', default=False)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # We don't want to benchmark - or pollute - the user's cache:
+        os.environ['PYDPLACE_CACHE_DIR'] = str(pathlib.Path(tmp) / 'cache')
+        timings = run(pathlib.Path(tmp) / 'ds', SIZES[args.size], workers=args.workers)
+
+    key = '{}-{}'.format(args.size, args.workers)
+    baselines = jsonlib.load(BASELINES) if BASELINES.exists() else {}
+    baseline, regressions = baselines.get(key, {}), []
+    for phase, secs in timings.items():
+        base = baseline.get(phase)
+        line = '{:<32}{:>9.2f}s'.format(phase, secs)
+        if base:
+            line += '{:>9.2f}s {:>7.2f}x'.format(base, secs / base)
+            if secs > base * args.tolerance and secs - base > args.min_diff:
+                regressions.append(phase)
+                line += '  REGRESSION'
+        print(line)
+
+    if args.update:
+        baselines[key] = {k: round(v, 3) for k, v in timings.items()}
+        jsonlib.dump(baselines, BASELINES, indent=4)
+    return 1 if regressions and not args.update else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
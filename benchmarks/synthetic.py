@@ -0,0 +1,132 @@
+"""
+Create a synthetic D-PLACE dataset with configurable size.
+
+The dataset directory contains a `cldfbench` module for a `DatasetWithSocieties` and all files
+in raw/ needed to run `dplace makecldf`, plus the files `dplace check` looks for.
+
+    python benchmarks/synthetic.py OUTDIR --rows 1000000
+"""
+import random
+import string
+import pathlib
+import argparse
+
+from csvw.dsv import UnicodeWriter
+from clldutils import jsonlib
+
+SIZES = {
+    'small': dict(variables=20, codes=5, societies=200, rows=10000, sources=1000),
+    'medium': dict(variables=200, codes=8, societies=2000, rows=500000, sources=20000),
+    'large': dict(variables=1000, codes=10, societies=5000, rows=2000000, sources=100000),
+}
+TYPES = ['Categorical', 'Ordinal', 'Continuous']
+MODULE = """import pathlib
+
+from pydplace import DatasetWithSocieties
+
+
+class Dataset(DatasetWithSocieties):
+    id = 'dplace-dataset-synthetic'
+    dir = pathlib.Path(__file__).parent
+"""
+
+
+def _word(rng, n=8):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(n))
+
+
+def make_dataset(d, variables=20, codes=5, societies=200, rows=10000, sources=1000, seed=0):
+    """
+    :param d: Directory to create the dataset in.
+    :param codes: Number of codes per categorical or ordinal variable.
+    :param rows: Number of rows of raw/data.csv.
+    :return: Path of the `cldfbench` module of the dataset.
+    """
+    rng = random.Random(seed)
+    d = pathlib.Path(d)
+    raw = d / 'raw'
+    raw.mkdir(parents=True, exist_ok=True)
+
+    var_types = {'SYN{}'.format(i + 1): TYPES[i % len(TYPES)] for i in range(variables)}
+    with UnicodeWriter(raw / 'variables.csv') as w:
+        w.writerow([
+            'id', 'category', 'title', 'definition', 'type', 'units', 'source', 'changes',
+            'notes'])
+        for vid, type_ in var_types.items():
+            w.writerow([
+                vid, 'Synthetic', 'Variable {}'.format(vid), '', type_,
+                'km' if type_ == 'Continuous' else '', 'synthetic', '', ''])
+
+    with UnicodeWriter(raw / 'codes.csv') as w:
+        w.writerow(['var_id', 'code', 'description', 'name'])
+        for vid, type_ in var_types.items():
+            if type_ != 'Continuous':
+                w.writerow([vid, 'NA', 'Missing data', 'Missing data'])
+                for i in range(1, codes + 1):
+                    w.writerow([vid, str(i), 'Code {} of {}'.format(i, vid), _word(rng)])
+
+    # Societies are spread uniformly over the inhabited latitudes.
+    soc_ids = ['SYN{}'.format(i + 1) for i in range(societies)]
+    with UnicodeWriter(raw / 'societies.csv') as w:
+        w.writerow([
+            'id', 'xd_id', 'pref_name_for_society', 'glottocode',
+            'ORIG_name_and_ID_in_this_dataset', 'alt_names_by_society', 'main_focal_year',
+            'HRAF_name_ID', 'HRAF_link', 'origLat', 'origLong', 'Lat', 'Long', 'Comment',
+            'glottocode_comment'])
+        for sid in soc_ids:
+            lat, lon = round(rng.uniform(-55, 70), 3), round(rng.uniform(-180, 180), 3)
+            name = _word(rng).capitalize()
+            w.writerow([
+                sid, '', name, '{}{:04d}'.format(_word(rng, 4), rng.randint(1000, 9999)),
+                '{} ({})'.format(name, sid), _word(rng), str(rng.randint(1800, 2000)),
+                '', '', lat, lon, lat, lon, '', ''])
+
+    keys = ['{}{}'.format(_word(rng, 6), 1800 + i % 200) for i in range(sources)]
+    with raw.joinpath('sources.bib').open('w', encoding='utf8') as f:
+        for key in keys:
+            f.write('@book{{{0},\n    author = {{{1}, {2}}},\n    title = {{{3}}},\n'
+                    '    year = {{{4}}}\n}}\n\n'.format(
+                        key, _word(rng).capitalize(), _word(rng).capitalize(),
+                        ' '.join(_word(rng) for _ in range(6)), key[-4:]))
+
+    var_ids = list(var_types)
+    with UnicodeWriter(raw / 'data.csv') as w:
+        w.writerow([
+            'soc_id', 'sub_case', 'year', 'var_id', 'code', 'comment', 'references',
+            'source_coded_data', 'admin_comment'])
+        for _ in range(rows):
+            vid = rng.choice(var_ids)
+            if var_types[vid] == 'Continuous':
+                code = str(round(rng.uniform(0, 1000), 2))
+            else:
+                code = str(rng.randint(1, codes))
+            w.writerow([
+                rng.choice(soc_ids), '', 'NA', vid, code, '',
+                '; '.join(rng.sample(keys, rng.randint(1, 3))), 'synthetic', ''])
+
+    jsonlib.dump(
+        dict(title='D-PLACE dataset derived from synthetic data', url='https://example.org'),
+        d / 'metadata.json',
+        indent=4)
+    for fname in ['map.png', 'CONTRIBUTORS.md', '.zenodo.json']:
+        d.joinpath(fname).write_text('', encoding='utf8')
+    module = d / 'cldfbench_synthetic.py'
+    module.write_text(MODULE, encoding='utf8')
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('outdir', type=pathlib.Path)
+    parser.add_argument('--size', choices=list(SIZES), default='small')
+    for name in SIZES['small']:
+        parser.add_argument('--' + name, type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    sizes = dict(SIZES[args.size])
+    sizes.update({k: getattr(args, k) for k in sizes if getattr(args, k) is not None})
+    print(make_dataset(args.outdir, seed=args.seed, **sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Random access to the entries of a (large) BibTeX file.
+
+Datasets typically cite only a small part of the entries in raw/sources.bib. So rather than parsing
+the whole file, we scan it once for entry keys, record their byte offsets in an index file in the
+cache dir, and parse entries only when they are requested.
+"""
+import os
+import re
+import json
+import mmap
+import hashlib
+import pathlib
+import tempfile
+
+from clldutils import jsonlib
+from pycldf.sources import Sources
+
+from pydplace.util import cache_dir
+
+__all__ = ['BibIndex']
+
+ENTRY_PATTERN = re.compile(
+    rb'^[ \t]*@[ \t]*(?P<type>[A-Za-z]+)[ \t]*[{(][ \t]*(?P<key>[^,\s})]*)', re.M)
+# Entries which must be passed to the parser along with each regular entry.
+MACRO_TYPES = {'string', 'preamble'}
+
+
+class BibIndex:
+    """
+    Lazily parsed BibTeX file.
+
+    The index is stored in the cache dir, keyed by the path of the BibTeX file, and re-created if
+    size or modification time of the file changed.
+
+    :ivar entries: `dict` mapping lowercase entry keys to `(start, end)` byte offsets.
+    """
+    def __init__(self, fname):
+        self.fname, self.index = pathlib.Path(fname), None
+        self.entries, self.macros = {}, []
+        if self.fname.exists():
+            self.fname = self.fname.resolve()
+            index_dir = cache_dir() / 'bibindex'
+            index_dir.mkdir(exist_ok=True)
+            self.index = index_dir / '{}.json'.format(
+                hashlib.md5(str(self.fname).encode()).hexdigest())
+            stat = self.fname.stat()
+            signature = [stat.st_size, stat.st_mtime_ns]
+            if self.index.exists():
+                d = jsonlib.load(self.index)
+                if d['signature'] == signature:
+                    self.entries = {k: tuple(v) for k, v in d['entries'].items()}
+                    self.macros = [tuple(v) for v in d['macros']]
+                    return
+            self.scan()
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=self.index.parent, suffix='.json', delete=False) as fp:
+                json.dump(dict(signature=signature, entries=self.entries, macros=self.macros), fp)
+            pathlib.Path(fp.name).replace(self.index)
+
+    def scan(self):
+        self.entries, self.macros = {}, []
+        with self.fname.open('rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                matches = list(ENTRY_PATTERN.finditer(m))
+                for match, end in zip(matches, [mm.start() for mm in matches[1:]] + [len(m)]):
+                    type_ = match.group('type').decode('ascii').lower()
+                    if type_ in MACRO_TYPES:
+                        self.macros.append((match.start(), end))
+                    elif type_ != 'comment':
+                        # Like `pycldf.Sources`, we keep the first of multiple entries with the
+                        # same key.
+                        self.entries.setdefault(
+                            match.group('key').decode('utf8').lower(), (match.start(), end))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key.lower() in self.entries
+
+    def _read(self, f, start, end):
+        f.seek(start)
+        return f.read(end - start).decode('utf8')
+
+    def __getitem__(self, key):
+        """
+        :return: `pycldf.sources.Source` instance for the entry `key`.
+        """
+        if key not in self:
+            raise ValueError('missing citekey: {}'.format(key))
+        with self.fname.open('rb') as f:
+            text = ''.join(
+                self._read(f, *span) for span in self.macros + [self.entries[key.lower()]])
+        sources = Sources()
+        sources.add(text)
+        return sources[key]
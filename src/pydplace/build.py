@@ -0,0 +1,117 @@
+"""
+Support for incremental CLDF creation.
+
+A makecldf run is split into stages - e.g. "values" or "societies" - which depend on a set of input
+files. Content hashes of these inputs are recorded in a manifest in the cache dir - keyed by the
+CLDF directory - so that a subsequent incremental run can re-use the output of the previous run for
+stages whose inputs did not change. The manifest also records a checksum of the output, so it is
+ignored if the CLDF directory was changed otherwise.
+"""
+import shutil
+import hashlib
+import inspect
+import pathlib
+import tempfile
+import contextlib
+
+from clldutils import jsonlib
+from clldutils.path import md5
+from pycldf import Dataset
+from pycldf.sources import Sources
+
+import pydplace
+from pydplace.util import cache_dir
+
+__all__ = ['Build', 'incremental', 'manifest_path']
+
+
+def manifest_path(cldf_dir):
+    """
+    :return: Path of the build manifest for a CLDF directory.
+    """
+    d = cache_dir() / 'builds'
+    d.mkdir(exist_ok=True)
+    return d / '{}.json'.format(
+        hashlib.md5(str(pathlib.Path(cldf_dir).resolve()).encode('utf8')).hexdigest())
+
+
+def _output_checksum(d):
+    h = hashlib.md5()
+    for p in sorted(p for p in pathlib.Path(d).iterdir() if p.is_file()):
+        h.update('{}:{}'.format(p.name, md5(p)).encode('utf8'))
+    return h.hexdigest()
+
+
+class Build:
+    """
+    :ivar previous: Directory containing the output of the previous makecldf run or `None`, in \
+    which case no stage is considered fresh.
+    :ivar hashes: `dict` mapping stage names to the hashes of their inputs.
+    """
+    def __init__(self, dataset=None, previous=None, manifest=None):
+        """
+        :param manifest: Path of the manifest of the previous run.
+        """
+        self.previous = pathlib.Path(previous) if previous else None
+        self.hashes = {}
+        self._previous_hashes = {}
+        if self.previous and manifest and pathlib.Path(manifest).exists():
+            d = jsonlib.load(manifest)
+            if d['output'] == _output_checksum(self.previous):
+                self._previous_hashes = d['stages']
+        # The code of the dataset is an input for all stages:
+        self._code = md5(inspect.getfile(type(dataset))) if dataset else ''
+
+    def is_fresh(self, stage, *inputs):
+        """
+        :param inputs: Paths of the input files of the stage.
+        :return: Flag signaling whether the output of the previous run can be re-used for `stage`.
+        """
+        if not self.previous:
+            return False
+        h = hashlib.md5()
+        for s in [pydplace.__version__, self._code]:
+            h.update(s.encode('utf8'))
+        for p in inputs:
+            h.update((md5(p) if p.exists() else '').encode('utf8'))
+        self.hashes[stage] = h.hexdigest()
+        return self._previous_hashes.get(stage) == self.hashes[stage]
+
+    @property
+    def cldf(self):
+        return Dataset.from_metadata(next(self.previous.glob('*-metadata.json')))
+
+    def reuse(self, writer, *components):
+        """
+        Pass the rows of tables from the previous output to `writer`.
+        """
+        cldf = self.cldf
+        for component in components:
+            if component in cldf:
+                writer.objects[component] = cldf[component].iterdicts()
+
+    def sources(self):
+        return Sources.from_file(self.previous / 'sources.bib')
+
+    def write_manifest(self, fname, d):
+        """
+        Write the manifest for the output in directory `d` to `fname`.
+        """
+        jsonlib.dump(dict(stages=self.hashes, output=_output_checksum(d)), fname, indent=4)
+
+
+@contextlib.contextmanager
+def incremental(dataset):
+    """
+    Context manager providing a `Build` for an incremental makecldf run of `dataset`.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        # The CLDF directory will be cleaned before the new run, so we stash the previous output.
+        if dataset.cldf_dir.exists():
+            for p in dataset.cldf_dir.iterdir():
+                if p.is_file():
+                    shutil.copy(p, tmp)
+        manifest = manifest_path(dataset.cldf_dir)
+        build = Build(dataset, tmp, manifest=manifest)
+        yield build
+        build.write_manifest(manifest, dataset.cldf_dir)
@@ -1,60 +1,112 @@
 """
-
+Check D-PLACE datasets for validity and conformance with D-PLACE conventions.
 """
-import subprocess
+import inspect
+import argparse
+import functools
+import multiprocessing
 
 from termcolor import colored
-from cldfbench.cli_util import add_dataset_spec, get_dataset
+from clldutils import jsonlib
+from cldfbench.cli_util import add_entry_point, get_datasets
+from cldfbench.dataset import dataset_from_module
 
-from pydplace import DatasetWithoutSocieties, DatasetWithSocieties
+from pydplace.validation import Validator
 
 
 def register(parser):
-    add_dataset_spec(parser)
+    parser.add_argument(
+        'dataset',
+        metavar='DATASET',
+        nargs='+',
+        help="Dataset spec, either ID of installed dataset or path to python module or "
+             "simplified glob pattern (where _ is understood as *) specifying python modules "
+             "(requires --glob option!).")
+    add_entry_point(parser)
+    parser.add_argument(
+        '--glob',
+        action='store_true',
+        default=False,
+        help="Interpret DATASET as simplified glob pattern relative to cwd.")
+    parser.add_argument(
+        '--workers',
+        help="Number of processes to use for checking multiple datasets",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        '--fast',
+        help="Only check metadata and required files, i.e. skip validation of the CLDF data",
+        action='store_true',
+        default=False,
+    )
+    parser.add_argument(
+        '--sample',
+        help="Only validate a reproducible random sample of N ValueTable rows",
+        metavar='N',
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        '--report',
+        help="Path to write a JSON report of the check results to",
+        default=None,
+    )
+
+
+def check(module, fast=False, sample=None):
+    """
+    :param module: Path of the Python module of a dataset.
+    :param fast: Flag signaling whether to run the metadata checks only.
+    :param sample: Number of ValueTable rows to validate or `None` to validate all rows.
+    :return: `dict` summarizing the check results.
+    """
+    ds = dataset_from_module(module)
+    res = dict(id=ds.id, module=str(module), passed=False, errors=[], warnings=[], timings={})
+    try:
+        validator = Validator(ds, fast=fast, sample=sample)
+        res['passed'] = validator()
+        res.update(errors=validator.errors, warnings=validator.warnings, timings=validator.timings)
+    except Exception as e:  # Make sure a broken dataset doesn't abort checking the others.
+        res['errors'].append('{}: {}'.format(e.__class__.__name__, e))
+    return res
+
+
+def iter_results(modules, workers=1, **kw):
+    check_ = functools.partial(check, **kw)
+    if workers <= 1:
+        yield from map(check_, modules)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(check_, modules)
+        pool.close()
+        pool.join()
 
 
 def run(args):
-    ds = get_dataset(args)
-    passed = True
-    assert ds.id.startswith('dplace-dataset-')
-    if subprocess.check_call(['cldf', 'validate', str(ds.cldf_dir)]) != 0:
-        passed = False  # pragma: no cover
-
-    cldf = ds.cldf_reader()
-    if not cldf.properties.get('dc:title', '').startswith(
-            'D-PLACE dataset derived from'):
+    modules = []
+    for spec in args.dataset:
+        for ds in get_datasets(argparse.Namespace(
+                dataset=spec, entry_point=args.entry_point, glob=args.glob)):
+            modules.append(inspect.getfile(type(ds)))
+
+    results = []
+    for res in iter_results(modules, workers=args.workers, fast=args.fast, sample=args.sample):
+        results.append(res)
+        if len(modules) > 1:
+            print(colored(res['id'], attrs={'bold'}))
+        for warning in res['warnings']:
+            print(colored(warning, 'yellow'))
+        for error in res['errors']:
+            print(colored(error, 'red'))
+        for check_, secs in res['timings'].items():
+            print('{:<22}{:>8.2f}s'.format(check_, secs))
         print(colored(
-            'Invalid dataset title in CLDF: {}'.format(
-                cldf.properties.get('dc:title')),
-            'red'))
-        passed = False
-
-    if issubclass(ds.__class__, DatasetWithoutSocieties):
-        if not ds.__society_sets__:
-            print(colored(
-                'Dataset without societies must reference at lease one society set',
-                'red'))
-            passed = False
-        if not cldf.properties.get('dc:references'):
-            print(colored(
-                'Referenced society sets not yet in CLDF. Re-run makecldf',
-                'red'))
-            passed = False
-    else:
-        assert issubclass(ds.__class__, DatasetWithSocieties)
-        if not ds.dir.joinpath('map.png').exists():
-            print(colored('map.png not found', 'red'))
-            passed = False
-
-    for fname in ['metadata.json', 'CONTRIBUTORS.md', '.zenodo.json']:
-        if not ds.dir.joinpath(fname).exists():
-            print(colored('{} not found'.format(fname), 'red'))
-            passed = False
-
-    for dp in ds.cldf_reader().objects('ValueTable'):
-        if len(dp.cldf.source) != len(set(dp.cldf.source)):
-            print(colored('{} duplicate reference'.format(dp.cldf.source), 'red'))
-            passed = False
-
-    print(colored('OK' if passed else 'FAIL', 'green' if passed else 'red', attrs={'bold'}))
-    return 0
+            'OK' if res['passed'] else 'FAIL',
+            'green' if res['passed'] else 'red',
+            attrs={'bold'}))
+
+    passed = all(res['passed'] for res in results)
+    if args.report:
+        jsonlib.dump(dict(passed=passed, datasets=results), args.report, indent=4)
+    return 0 if passed else 1
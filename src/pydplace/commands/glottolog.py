@@ -9,6 +9,15 @@ from cldfcatalog import Catalog
 from pydplace import glottolog
 
 
+def register(parser):
+    parser.add_argument(
+        '--workers',
+        help="Number of processes to use for writing the family trees",
+        type=int,
+        default=1,
+    )
+
+
 def run(args):  # pragma: no cover
     with contextlib.ExitStack() as stack:
         if args.glottolog_version:  # pragma: no cover
@@ -17,4 +26,6 @@ def run(args):  # pragma: no cover
             args.repos,
             args.glottolog,
             str(datetime.date.today().year),
-            "Glottolog {0}".format(args.glottolog_version))
+            "Glottolog {0}".format(args.glottolog_version),
+            version=args.glottolog_version,
+            workers=args.workers)
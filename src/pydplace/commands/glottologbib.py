@@ -1,23 +1,150 @@
 """
 Augment sources.bib with lgcode for use as Glottolog reference provider.
 """
+import re
+import pathlib
+import argparse
+import tempfile
 import collections
 
+from cldfbench.cli_util import add_entry_point, get_datasets
+from cldfbench.dataset import get_dataset
+from pycldf.sources import Sources
 
-def run(args):  # pragma: no cover
+from pydplace.bibindex import BibIndex, ENTRY_PATTERN
+
+LGCODE_PATTERN = re.compile(r'(?P<field>\n[ \t]*lgcode[ \t]*=[ \t]*)(?:\{[^{}]*\}|"[^"]*")', re.I)
+SOCIETY_PATTERN = re.compile(r'\s*,?\s*(?P<name>[^\[\]]*?)\s*\[(?P<glottocode>[^\[\]]+)\]')
+
+
+def register(parser):
+    parser.add_argument(
+        'dataset',
+        metavar='DATASET',
+        nargs='+',
+        help="Dataset spec, either ID of installed dataset or path to python module or "
+             "simplified glob pattern (where _ is understood as *) specifying python modules "
+             "(requires --glob option!).")
+    add_entry_point(parser)
+    parser.add_argument(
+        '--glob',
+        action='store_true',
+        default=False,
+        help="Interpret DATASET as simplified glob pattern relative to cwd.")
+    parser.add_argument(
+        '--bibfile',
+        help="BibTeX file to augment with lgcode for the references of all datasets. By default, "
+             "raw/sources.bib of each dataset is augmented.",
+        type=pathlib.Path,
+        default=None,
+    )
+
+
+def societies(ds, log=None):
+    """
+    :return: `dict` mapping IDs of societies with glottocode to pairs `(name, glottocode)`.
+    """
+    cldf = ds.cldf_reader()
+    if 'LanguageTable' in cldf:
+        readers = [cldf]
+    else:  # The societies are defined in the society sets referenced by the dataset.
+        readers = []
+        for spec in cldf.properties.get('dc:references') or []:
+            sset = get_dataset(spec)
+            if sset:
+                readers.append(sset.cldf_reader())
+            elif log:
+                log.warning('Society set {} not found'.format(spec))
+    return {
+        row['id']: (row['name'], row['glottocode']) for reader in readers
+        for row in reader.iter_rows('LanguageTable', 'id', 'name', 'glottocode')
+        if row['glottocode']}
+
+
+def reference_index(ds, log=None):
+    """
+    Index the references of a dataset in one pass over the ValueTable.
+
+    :return: `dict` mapping lowercase source keys to `set`s of pairs `(society name, glottocode)`.
+    """
     refs = collections.defaultdict(set)
+    for row in ds.cldf_reader().iter_rows('ValueTable', 'languageReference', 'source'):
+        for ref in row['source'] or []:
+            refs[Sources.parse(ref)[0].lower()].add(row['languageReference'])
+    socs = societies(ds, log=log)
+    return {key: {socs[sid] for sid in sids if sid in socs} for key, sids in refs.items()}
 
-    socs = {}
-    for id_, soc in args.repos.societies.items():
-        socs[id_] = soc
 
-    for d in args.repos.iter_data():
-        for ref in d.references:
-            soc = socs[d.soc_id]
-            refs[ref.key].add((soc.pref_name_for_society, soc.glottocode))
+def parse_lgcode(s):
+    """
+    :return: `set` of pairs `(society name, glottocode)` listed in an lgcode field.
+    """
+    return {(m.group('name'), m.group('glottocode')) for m in SOCIETY_PATTERN.finditer(s)}
 
-    def add_lgcode(e):
-        if e.key in refs:
-            e.fields['lgcode'] = ', '.join('{0} [{1}]'.format(*soc) for soc in sorted(refs[e.key]))
 
-    args.repos.sources.visit(add_lgcode)
+def update_lgcodes(fname, refs):
+    """
+    Add the societies in `refs` to the lgcode field of the entries of a BibTeX file.
+
+    Societies already listed in lgcode are kept - they may be cited with the reference in other
+    datasets. Only entries with changed lgcode are rewritten - all other content of the file is
+    kept as is - and the file is only written if any entry changed.
+
+    :param refs: `dict` as returned by `reference_index`.
+    :return: Number of updated entries.
+    """
+    bib = BibIndex(fname)
+    data = fname.read_bytes()
+    chunks, pos, updated = [], 0, 0
+    for (start, end), key in sorted((bib.entries[key], key) for key in refs if key in bib):
+        if not refs[key]:
+            continue
+        entry = data[start:end].decode('utf8')
+        match = LGCODE_PATTERN.search(entry)
+        existing = parse_lgcode(match.group(0)[len(match.group('field')) + 1:-1]) \
+            if match else set()
+        if refs[key] <= existing:
+            continue
+        lgcode = ', '.join('{0} [{1}]'.format(*soc) for soc in sorted(existing | refs[key]))
+        if match:
+            entry = '{}{}{{{}}}{}'.format(
+                entry[:match.start()], match.group('field'), lgcode, entry[match.end():])
+        else:
+            i = len(data[start:ENTRY_PATTERN.match(data, start).end()].decode('utf8'))
+            comma = re.match(r'\s*,', entry[i:])
+            if comma:
+                i += comma.end()
+            entry = '{}{}\n    lgcode = {{{}}}{}{}'.format(
+                entry[:i], '' if comma else ',', lgcode, ',' if comma else '', entry[i:])
+        chunks.extend([data[pos:start], entry.encode('utf8')])
+        pos = end
+        updated += 1
+
+    if updated:
+        chunks.append(data[pos:])
+        # We write to a temporary file first, to not leave incomplete files around.
+        with tempfile.NamedTemporaryFile(dir=fname.parent, suffix='.bib', delete=False) as fp:
+            fp.write(b''.join(chunks))
+        pathlib.Path(fp.name).replace(fname)
+    return updated
+
+
+def run(args):
+    datasets = []
+    for spec in args.dataset:
+        datasets.extend(get_datasets(argparse.Namespace(
+            dataset=spec, entry_point=args.entry_point, glob=args.glob)))
+
+    # References may be cited in more than one dataset, so we always index all datasets:
+    refs = collections.defaultdict(set)
+    for ds in datasets:
+        for key, socs in reference_index(ds, log=args.log).items():
+            refs[key] |= socs
+
+    # We update the maintained bibliography - cldf/sources.bib is re-created by makecldf.
+    targets = [args.bibfile] if args.bibfile else [ds.raw_dir / 'sources.bib' for ds in datasets]
+    for fname in targets:
+        if fname.exists():
+            args.log.info('{}: {} entries updated'.format(fname, update_lgcodes(fname, refs)))
+        else:
+            args.log.warning('{} does not exist'.format(fname))
@@ -0,0 +1,71 @@
+"""
+Run `cldfbench makecldf` on a D-PLACE dataset, with additional pydplace specific options.
+"""
+from cldfbench.__main__ import main as cldfbench_main
+from cldfbench.commands import makecldf
+
+
+def register(parser):
+    makecldf.register(parser)
+    parser.add_argument(
+        '--no-region-cache',
+        help="Do not use the persistent cache of matched WGSRPD regions",
+        action='store_true',
+        default=False,
+    )
+    parser.add_argument(
+        '--clear-region-cache',
+        help="Clear the persistent cache of matched WGSRPD regions before running makecldf",
+        action='store_true',
+        default=False,
+    )
+    parser.add_argument(
+        '--stream-values',
+        help="Convert ValueTable rows while writing CLDF data.csv, rather than collecting them in "
+             "memory first. Note: This only works for datasets which do not manipulate "
+             "`writer.objects['ValueTable']` in custom code.",
+        action='store_true',
+        default=False,
+    )
+    parser.add_argument(
+        '--workers',
+        help="Number of processes to use for converting raw/data.csv",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        '--incremental',
+        help="Re-use the output of the previous run for stages (parameters, values, sources, "
+             "societies) whose input files did not change",
+        action='store_true',
+        default=False,
+    )
+    parser.add_argument(
+        '--raw-cache',
+        help="Read the raw CSV files from a columnar cache in the cache dir, which is only updated "
+             "when the files change",
+        action='store_true',
+        default=False,
+    )
+    parser.add_argument(
+        '--profile',
+        help="Path to write a JSON report of wall time, row counts and peak memory of the phases "
+             "of CLDF creation to",
+        metavar='PATH',
+        default=None,
+    )
+    parser.add_argument(
+        '--cprofile',
+        help="Name of a phase (e.g. values) to write cProfile stats for to <PATH>.prof, where "
+             "PATH is the path passed as --profile",
+        metavar='PHASE',
+        default=None,
+    )
+    # cldfbench's catalog handling expects this option:
+    parser.set_defaults(no_config=False)
+
+
+def run(args):
+    # We let cldfbench set up the catalogs and then run its makecldf command:
+    args.main = makecldf.run
+    return cldfbench_main(parsed_args=args, log=args.log)
@@ -0,0 +1,67 @@
+"""
+Query the values of datasets by cross-dataset society ID (xd_id).
+
+Matching values are written as CSV to stdout.
+"""
+import csv
+import sys
+import pathlib
+import argparse
+
+from csvw import dsv
+from cldfbench.cli_util import add_entry_point, get_datasets
+
+from pydplace.query import CrossDatasetIndex
+
+COLUMNS = ['ID', 'Soc_ID', 'Var_ID', 'Value', 'Code_ID', 'Comment', 'Source', 'sub_case', 'year']
+
+
+def register(parser):
+    parser.add_argument(
+        'dataset',
+        metavar='DATASET',
+        nargs='+',
+        help="Dataset spec, either ID of installed dataset or path to python module or "
+             "simplified glob pattern (where _ is understood as *) specifying python modules "
+             "(requires --glob option!).")
+    add_entry_point(parser)
+    parser.add_argument(
+        '--glob',
+        action='store_true',
+        default=False,
+        help="Interpret DATASET as simplified glob pattern relative to cwd.")
+    parser.add_argument(
+        '--xd-id',
+        help="Cross-dataset society ID to query (may be specified multiple times).",
+        action='append',
+        default=[],
+    )
+    parser.add_argument(
+        '--var',
+        help="Restrict the values for --xd-id to this variable (may be specified multiple times).",
+        action='append',
+        default=None,
+    )
+    parser.add_argument(
+        '--queries',
+        help="CSV file with a batch of queries, with columns xd_id and (optionally) Var_ID.",
+        type=pathlib.Path,
+        default=None,
+    )
+
+
+def run(args):
+    queries = [(xd_id, args.var) for xd_id in args.xd_id]
+    if args.queries:
+        for row in dsv.reader(args.queries, dicts=True):
+            queries.append((row['xd_id'], [row['Var_ID']] if row.get('Var_ID') else None))
+
+    datasets = []
+    for spec in args.dataset:
+        datasets.extend(get_datasets(argparse.Namespace(
+            dataset=spec, entry_point=args.entry_point, glob=args.glob)))
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['dataset', 'xd_id'] + COLUMNS)
+    for match in CrossDatasetIndex(datasets).batch(queries):
+        writer.writerow([match.dataset, match.xd_id] + [match.value.get(c) for c in COLUMNS])
@@ -0,0 +1,44 @@
+"""
+Export datasets into a single SQLite database.
+
+Datasets which did not change since the last export are skipped.
+"""
+import pathlib
+import argparse
+
+from cldfbench.cli_util import add_entry_point, get_datasets
+
+from pydplace.db import Database
+
+
+def register(parser):
+    parser.add_argument(
+        'db',
+        metavar='DB',
+        help="Path of the SQLite database file.",
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        'dataset',
+        metavar='DATASET',
+        nargs='+',
+        help="Dataset spec, either ID of installed dataset or path to python module or "
+             "simplified glob pattern (where _ is understood as *) specifying python modules "
+             "(requires --glob option!).")
+    add_entry_point(parser)
+    parser.add_argument(
+        '--glob',
+        action='store_true',
+        default=False,
+        help="Interpret DATASET as simplified glob pattern relative to cwd.")
+
+
+def run(args):
+    db = Database(args.db)
+    for spec in args.dataset:
+        for ds in get_datasets(argparse.Namespace(
+                dataset=spec, entry_point=args.entry_point, glob=args.glob)):
+            if db.export(ds):
+                args.log.info('{}: exported'.format(ds.id))
+            else:
+                args.log.info('{}: unchanged'.format(ds.id))
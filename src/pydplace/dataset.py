@@ -1,15 +1,37 @@
+import io
 import re
+import sys
+import types
 import pathlib
+import functools
+import itertools
+import collections.abc
+import multiprocessing
 
-from pycldf.sources import Sources
+from csvw import dsv
 from cldfbench import Dataset as BaseDataset, CLDFSpec
 from clldutils import jsonlib
 from clldutils.markup import add_markdown_text
 
-from .util import comma_split, semicolon_split, split
-from .geo import Regions
+from .util import comma_split, semicolon_split, split, csv_chunks
+from .build import Build, incremental
+from .bibindex import BibIndex
+from .profiling import Profiler, phase
+from .rawcache import iter_csv, read_csv
 
 XD_IDS = pathlib.Path(__file__).parent / 'cross_dataset_ids.json'
+# Note: We don't import `geo.GEOJSON`, because importing `pydplace.geo` is comparatively slow.
+GEOJSON = pathlib.Path(__file__).parent / 'wgsrpd_level2.geojson'
+
+
+@functools.lru_cache(maxsize=None)
+def get_xd_ids():
+    """
+    :return: Read-only mapping of society IDs to cross-dataset IDs. (Since the mapping is shared \
+    by all callers, it must not be changed.)
+    """
+    return types.MappingProxyType(
+        {lid: xd_id for xd_id, ext in jsonlib.load(XD_IDS).items() for lid in ext})
 
 
 def hraf_id(name_and_id):
@@ -18,14 +40,247 @@ def hraf_id(name_and_id):
         return match.group('id')
 
 
+@functools.lru_cache(maxsize=None)
 def valid_id(s):
     return s.replace('.', '_')
 
 
-def add_data(raw_dir, writer):
+@functools.lru_cache(maxsize=None)
+def code_id(var_id, code):
+    return '{}-{}'.format(valid_id(var_id), code.replace('.', ''))
+
+
+def iter_references(s):
+    """
+    :param s: `;`-separated list of references as given in the raw data.
+    :return: Generator of pairs `(source key, CLDF reference)`, skipping duplicate references.
+    """
+    seen = set()
+    for src in semicolon_split(s):
+        src, _, pages = src.partition(':')
+        ref = src
+        if pages:
+            ref += '[{}]'.format(pages)
+        if ref not in seen:
+            seen.add(ref)
+            yield src, ref
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def references(s):
+    """
+    Since the same references are typically cited for many values, we share the results.
+
+    :return: Pair `(tuple of source keys, tuple of CLDF references)` for `s`.
+    """
+    res = list(iter_references(s))
+    return tuple(src for src, _ in res), tuple(ref for _, ref in res)
+
+
+class _Deleted:
+    """
+    Marker for deleted fields of a `Value`. (We use the class, because it is pickled by reference.)
+    """
+
+
+class Value(collections.abc.MutableMapping):
+    """
+    A ValueTable row.
+
+    Rows can be used like `dict`s, but the fields of the ValueTable are stored in slots, which
+    needs much less memory for datasets with millions of values. Additional fields are stored in
+    a `dict`. Deleted fields are marked with `_Deleted`.
+    """
+    __fields__ = (
+        'ID', 'Var_ID', 'Code_ID', 'Soc_ID', 'Value', 'Comment', 'Source', 'sub_case',
+        'source_coded_data', 'admin_comment', 'year')
+    __slots__ = __fields__ + ('_extra',)
+
+    def __init__(
+            self, ID=None, Var_ID=None, Code_ID=None, Soc_ID=None, Value=None, Comment=None,
+            Source=None, sub_case=None, source_coded_data=None, admin_comment=None, year=None,
+            **extra):
+        self.ID = ID
+        self.Var_ID = Var_ID
+        self.Code_ID = Code_ID
+        self.Soc_ID = Soc_ID
+        self.Value = Value
+        self.Comment = Comment
+        self.Source = Source
+        self.sub_case = sub_case
+        self.source_coded_data = source_coded_data
+        self.admin_comment = admin_comment
+        self.year = year
+        self._extra = extra or None
+
+    def __reduce__(self):
+        return _value, tuple(getattr(self, k) for k in self.__slots__)
+
+    def get(self, key, default=None):
+        if key in _VALUE_FIELDS:
+            res = getattr(self, key)
+            return default if res is _Deleted else res
+        return self._extra.get(key, default) if self._extra else default
+
+    def __getitem__(self, key):
+        if key in _VALUE_FIELDS:
+            res = getattr(self, key)
+            if res is not _Deleted:
+                return res
+        elif self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _VALUE_FIELDS:
+            setattr(self, key, value)
+        else:
+            self._extra = self._extra or {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _VALUE_FIELDS and getattr(self, key) is not _Deleted:
+            setattr(self, key, _Deleted)
+        elif self._extra and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.__fields__:
+            if getattr(self, key) is not _Deleted:
+                yield key
+        yield from self._extra or ()
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'Value({})'.format(dict(self))
+
+
+_VALUE_FIELDS = frozenset(Value.__fields__)
+
+
+def _value(*args):
+    res = Value(*args[:-1])
+    res._extra = args[-1]
+    return res
+
+
+def _intern(s):
+    # Short rows in raw/data.csv are padded with `None` by `csvw`.
+    return s if s is None else sys.intern(s)
+
+
+def value(i, row, codes):
+    """
+    Convert a row from raw/data.csv to a ValueTable row.
+
+    :param i: Index of the row in raw/data.csv.
+    :param codes: `dict` mapping `(var_id, code)` pairs to code names.
+    """
+    var_id, code = row['var_id'], row['code']
+    val = codes.get((var_id, code), code)
+    if val in {'NA', '?'}:
+        val = None
+    return Value(
+        str(i + 1),
+        valid_id(var_id),
+        code_id(var_id, code) if (var_id, code) in codes else None,
+        _intern(row['soc_id']),
+        val,
+        row['comment'],
+        # We return a list - like for `dict` rows - which still shares the reference strings.
+        list(references(row['references'])[1]),
+        row['sub_case'],
+        _intern(row['source_coded_data']),
+        row['admin_comment'],
+        None if row['year'] == 'NA' else _intern(row['year']),
+    )
+
+
+# Codes mapping, as shared with worker processes, see `_init_worker`.
+_codes = None
+
+
+def _init_worker(codes):
+    global _codes
+    _codes = codes
+
+
+def _convert_chunk(task):
+    fname, start, end, fieldnames, with_values = task
+    if fieldnames is None:  # The chunk is specified as range of rows in the cached table.
+        rows = iter_csv(fname, cache=True, start=start, end=end)
+    else:
+        with open(fname, 'rb') as f:
+            f.seek(start)
+            text = f.read(end - start).decode('utf8')
+        rows = dsv.reader(io.StringIO(text), dicts=True, fieldnames=fieldnames)
+    keys, values = {}, []
+    for i, row in enumerate(rows):
+        keys.update((src, None) for src in references(row['references'])[0])
+        if with_values:
+            values.append(value(i, row, _codes))
+    return list(keys), values
+
+
+def iter_value_batches(
+        raw_dir, codes, workers=1, with_values=True, chunksize=None, raw_cache=False):
+    """
+    Convert the rows of raw/data.csv to ValueTable rows.
+
+    :param workers: If bigger than 1, raw/data.csv is split into chunks which are converted by a \
+    pool of `workers` processes.
+    :param with_values: If `False`, only the cited source keys are returned.
+    :param raw_cache: Flag signaling whether to read raw/data.csv from the columnar cache.
+    :return: Generator of pairs `(source keys, ValueTable rows)`, in the order of raw/data.csv.
+    """
+    fname = raw_dir / 'data.csv'
+    if workers <= 1:
+        # Note: `raw_dir.read_csv` returns a list, so we read rows lazily.
+        for i, row in enumerate(iter_csv(fname, cache=raw_cache)):
+            yield (
+                references(row['references'])[0],
+                [value(i, row, codes)] if with_values else [])
+        return
+
+    table = read_csv(fname) if raw_cache else None
+    if table:
+        n = chunksize or max(len(table) // (4 * workers), 10000)
+        tasks = [(fname, start, start + n, None, with_values) for start in range(0, len(table), n)]
+    else:
+        header, chunks = csv_chunks(
+            fname, chunksize or max(fname.stat().st_size // (4 * workers), 1024 * 1024))
+        fieldnames = next(dsv.reader([header.decode('utf-8-sig')]))
+        tasks = [(fname, start, end, fieldnames, with_values) for start, end in chunks]
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(codes,)) as pool:
+        offset = 0
+        for keys, values in pool.imap(_convert_chunk, tasks):
+            # Rows are numbered per chunk, so we must re-number them to get sequential IDs.
+            for i, row in enumerate(values, start=offset + 1):
+                row['ID'] = str(i)
+            offset += len(values)
+            yield keys, values
+        pool.close()
+        pool.join()
+
+
+def iter_values(raw_dir, codes, workers=1, raw_cache=False):
+    for _, values in iter_value_batches(raw_dir, codes, workers=workers, raw_cache=raw_cache):
+        yield from values
+
+
+def read_parameters(raw_dir, raw_cache=False):
+    """
+    :param raw_cache: Flag signaling whether to read the CSV files from the columnar cache.
+    :return: Triple `(ParameterTable rows, CodeTable rows, codes mapping)`.
+    """
+    parameters, codes, code_names = [], [], {}
     continuous = set()
-    for row in raw_dir.read_csv('variables.csv', dicts=True):
-        writer.objects['ParameterTable'].append(dict(
+    for row in iter_csv(raw_dir / 'variables.csv', cache=raw_cache):
+        parameters.append(dict(
             ID=valid_id(row['id']),
             Name=row['title'],
             Description=row['definition'],
@@ -40,52 +295,94 @@ def add_data(raw_dir, writer):
         if row['type'] == 'Continuous':
             continuous.add(row['id'])
 
-    codes = {}
     if raw_dir.joinpath('codes.csv').exists():
-        for row in raw_dir.read_csv('codes.csv', dicts=True):
+        for row in iter_csv(raw_dir / 'codes.csv', cache=raw_cache):
             if row['var_id'] not in continuous:
-                writer.objects['CodeTable'].append(dict(
-                    ID='{}-{}'.format(valid_id(row['var_id']), row['code'].replace('.', '')),
+                codes.append(dict(
+                    ID=code_id(row['var_id'], row['code']),
                     Var_ID=valid_id(row['var_id']),
                     Name=row['name'],
                     Description=row['description'],
                     ord=int(row['code'].replace('.', '')) if row['code'] != 'NA' else 99,
                 ))
-                codes[(row['var_id'], row['code'])] = (
+                code_names[(row['var_id'], row['code'])] = (
                     row)['name'] if row['name'].lower() != 'missing data' else None
-
-    refs = set()
-    sources = Sources.from_file(raw_dir / 'sources.bib')
-
-    for i, row in enumerate(raw_dir.read_csv('data.csv', dicts=True)):
-        ref = []
-        for src in semicolon_split(row['references']):
-            src, _, pages = src.partition(':')
+    return parameters, codes, code_names
+
+
+def add_data(
+        raw_dir, writer, stream=False, workers=1, build=None, profiler=None, raw_cache=False):
+    """
+    Add the data from raw/variables.csv, raw/codes.csv, raw/data.csv and raw/sources.bib.
+
+    :param stream: If `True`, ValueTable rows are not accumulated in `writer.objects` but passed \
+    as generator, i.e. converted while the CLDF data.csv is written. Thus, memory consumption does \
+    not depend on the number of values - but rows cannot be manipulated before writing.
+    :param workers: Number of processes to use for converting raw/data.csv.
+    :param build: `pydplace.build.Build` instance, to re-use output of a previous run.
+    :param profiler: `pydplace.profiling.Profiler` instance to record the phases of the conversion.
+    :param raw_cache: Flag signaling whether to read the raw CSV files from the columnar cache.
+    """
+    build = build or Build()
+    variables, codes, data = [raw_dir / fn for fn in ['variables.csv', 'codes.csv', 'data.csv']]
+    parameters_fresh = build.is_fresh('parameters', variables, codes)
+    values_fresh = build.is_fresh('values', variables, codes, data)
+    sources_fresh = build.is_fresh('sources', data, raw_dir / 'sources.bib')
+
+    code_names = {}
+    if parameters_fresh:
+        build.reuse(writer, 'ParameterTable', 'CodeTable')
+    if not (parameters_fresh and values_fresh):
+        with phase(profiler, 'parameters') as counts:
+            parameters, codes, code_names = read_parameters(raw_dir, raw_cache=raw_cache)
+            counts['rows'] = len(parameters) + len(codes)
+        if not parameters_fresh:
+            writer.objects['ParameterTable'].extend(parameters)
+            writer.objects['CodeTable'].extend(codes)
+
+    refs, sources = set(), None
+    if sources_fresh:
+        with phase(profiler, 'sources'):
+            writer.cldf.add_sources(*build.sources())
+
+    def add_sources(keys):
+        nonlocal sources
+        if sources_fresh:
+            return
+        for src in keys:
             if src not in refs:
-                writer.cldf.add_sources(sources[src])
-                refs.add(src)
-            r = src
-            if pages:
-                r += '[{}]'.format(pages)
-            if r not in ref:
-                ref.append(r)
-        val = codes.get((row['var_id'], row['code']), row['code'])
-        if val in {'NA', '?'}:
-            val = None
-        writer.objects['ValueTable'].append(dict(
-            ID=str(i + 1),
-            Var_ID=valid_id(row['var_id']),
-            Code_ID='{}-{}'.format(valid_id(row['var_id']), row['code'].replace('.', ''))
-            if (row['var_id'], row['code']) in codes else None,
-            Soc_ID=row['soc_id'],
-            Value=val,
-            Comment=row['comment'],
-            Source=ref,
-            sub_case=row['sub_case'],
-            source_coded_data=row['source_coded_data'],
-            admin_comment=row['admin_comment'],
-            year=None if row['year'] == 'NA' else row['year'],
-        ))
+                with phase(profiler, 'sources', rows=1):
+                    sources = sources or BibIndex(raw_dir / 'sources.bib')
+                    writer.cldf.add_sources(sources[src])
+                    refs.add(src)
+
+    if values_fresh:
+        if not sources_fresh:
+            with phase(profiler, 'values'):
+                for keys, _ in iter_value_batches(
+                        raw_dir, {}, workers=workers, with_values=False, raw_cache=raw_cache):
+                    add_sources(keys)
+        build.reuse(writer, 'ValueTable')
+        return
+
+    batches = iter_value_batches(
+        raw_dir, code_names, workers=workers, with_values=not stream, raw_cache=raw_cache)
+    if stream:
+        # Sources are written before the tables, so we must collect them in a separate pass.
+        if not sources_fresh:
+            with phase(profiler, 'values'):
+                for keys, _ in batches:
+                    add_sources(keys)
+        writer.objects['ValueTable'] = itertools.chain(
+            writer.objects['ValueTable'],
+            iter_values(raw_dir, code_names, workers=workers, raw_cache=raw_cache))
+        return
+
+    with phase(profiler, 'values') as counts:
+        for keys, values in batches:
+            add_sources(keys)
+            writer.objects['ValueTable'].extend(values)
+        counts['rows'] = len(writer.objects['ValueTable'])
 
 
 def data_schema(cldf, with_codes=True):
@@ -178,15 +475,82 @@ class WithPrefix:
         return '{}{}'.format(id_.split('-')[-1].upper(), s)
 
 
-class DatasetWithSocieties(BaseDataset, WithPrefix):
-    def __init__(self):
-        BaseDataset.__init__(self)
-        # We enrich data with the cross-dataset ID and a WGSRPD region.
-        self.xd_ids = {}
-        for xd_id, ext in jsonlib.load(XD_IDS).items():
-            for lid in ext:
-                self.xd_ids[lid] = xd_id
-        self.regions = Regions()
+class WithIncrementalBuild:
+    """
+    Mixin for datasets supporting incremental CLDF creation, i.e. `makecldf --incremental`.
+
+    Since we cannot know the inputs of custom code, datasets overriding `cmd_makecldf` or
+    `local_makecldf` are always built completely.
+    """
+    def _cmd_makecldf(self, args):
+        if getattr(args, 'incremental', False):
+            customized = [
+                name for name in ['cmd_makecldf', 'local_makecldf']
+                if hasattr(self, name) and getattr(type(self), name) not in {
+                    getattr(cls, name, None)
+                    for cls in [DatasetWithSocieties, DatasetWithoutSocieties]}]
+            if not customized:
+                with incremental(self) as args.build:
+                    return super()._cmd_makecldf(args)
+            args.log.warning(
+                'No incremental build for datasets with custom {}'.format(', '.join(customized)))
+        return super()._cmd_makecldf(args)
+
+
+def _count(rows, counts):
+    for row in rows:
+        counts['rows'] += 1
+        yield row
+
+
+class WithProfile:
+    """
+    Mixin for datasets supporting instrumentation of CLDF creation, i.e. `makecldf --profile`.
+    """
+    def cldf_writer(self, args, **kw):
+        writer = super().cldf_writer(args, **kw)
+        profiler, write = getattr(args, 'profiler', None), writer.write
+        if profiler:
+            def profiled_write(**items):
+                with profiler.phase('write', rows=0) as counts:
+                    for name, rows in items.items():
+                        if name in {'fname', 'zipped'}:  # Not table items.
+                            continue
+                        if isinstance(rows, list):
+                            counts['rows'] += len(rows)
+                        else:  # Rows are passed as generator, e.g. for streamed values.
+                            items[name] = _count(rows, counts)
+                    return write(**items)
+
+            writer.write = profiled_write
+        return writer
+
+    def _cmd_makecldf(self, args):
+        if not getattr(args, 'profile', None):
+            return super()._cmd_makecldf(args)
+        with Profiler(cprofile=getattr(args, 'cprofile', None)) as args.profiler:
+            with args.profiler.phase('total'):
+                res = super()._cmd_makecldf(args)
+        for name, stats in args.profiler.report().items():
+            args.log.info('{:<16}{:>10.2f}s{:>10} rows'.format(
+                name, stats['seconds'], stats['rows'] if stats['rows'] is not None else ''))
+        args.profiler.write(args.profile, dataset=self.id)
+        return res
+
+
+class DatasetWithSocieties(WithProfile, WithIncrementalBuild, BaseDataset, WithPrefix):
+    # We enrich data with the cross-dataset ID and a WGSRPD region. Since this is only needed when
+    # running makecldf, the required data is loaded lazily.
+    @functools.cached_property
+    def xd_ids(self):
+        return get_xd_ids()
+
+    @functools.cached_property
+    def regions(self):
+        # Importing shapely and numpy is comparatively slow, thus we only do it when needed.
+        from .geo import get_regions, RegionCache
+
+        return RegionCache(get_regions())
 
     def cldf_specs(self):
         return CLDFSpec(
@@ -278,12 +642,12 @@ class DatasetWithSocieties(BaseDataset, WithPrefix):
         """
         Enrich and add the data of a society for the CLDF dataset.
 
-        :param props:
+        :param props: Society properties. If `region` is not passed, it will be computed from \
+        `Longitude` and `Latitude`.
         """
-        props.update(
-            region=self.regions.match(props['Longitude'], props['Latitude'])[0],
-            xd_id=self.xd_ids.get(props['ID']),
-        )
+        if 'region' not in props:
+            props['region'] = self.regions.match(props['Longitude'], props['Latitude'])[0]
+        props['xd_id'] = self.xd_ids.get(props['ID'])
         writer.objects['LanguageTable'].append(props)
 
     def local_makecldf(self, args):
@@ -293,14 +657,46 @@ class DatasetWithSocieties(BaseDataset, WithPrefix):
         pass
 
     def cmd_makecldf(self, args):
-        data_schema(args.writer.cldf)
-        self.schema(args.writer.cldf)
-
-        add_data(self.raw_dir, args.writer)
-
-        for row in self.raw_dir.read_csv('societies.csv', dicts=True):
+        profiler = getattr(args, 'profiler', None)
+        with phase(profiler, 'data_schema'):
+            data_schema(args.writer.cldf)
+        with phase(profiler, 'schema'):
+            self.schema(args.writer.cldf)
+
+        build = getattr(args, 'build', None) or Build()
+        add_data(
+            self.raw_dir,
+            args.writer,
+            stream=getattr(args, 'stream_values', False),
+            workers=getattr(args, 'workers', 1),
+            build=build,
+            profiler=profiler,
+            raw_cache=getattr(args, 'raw_cache', False))
+
+        if getattr(args, 'clear_region_cache', False):
+            self.regions.clear()
+        if build.is_fresh('societies', self.raw_dir / 'societies.csv', XD_IDS, GEOJSON):
+            build.reuse(args.writer, 'LanguageTable')
+            with phase(profiler, 'local_makecldf'):
+                self.local_makecldf(args)
+            return
+
+        with phase(profiler, 'societies') as counts:
+            self._add_societies(args)
+            counts['rows'] = len(args.writer.objects['LanguageTable'])
+        with phase(profiler, 'local_makecldf'):
+            self.local_makecldf(args)
+
+    def _add_societies(self, args):
+        regions = self.regions.regions if getattr(args, 'no_region_cache', False) else self.regions
+        societies = list(iter_csv(
+            self.raw_dir / 'societies.csv', cache=getattr(args, 'raw_cache', False)))
+        regions = regions.match_many(
+            [row['Long'] for row in societies], [row['Lat'] for row in societies])
+        for row, (region, _) in zip(societies, regions):
             self.add_society(
                 args.writer,
+                region=region,
                 ID=row['id'],
                 Name=row['pref_name_for_society'],
                 Glottocode=row['glottocode'],
@@ -316,7 +712,6 @@ class DatasetWithSocieties(BaseDataset, WithPrefix):
                 comment=row['Comment'],
                 glottocode_comment=row['glottocode_comment'],
             )
-        self.local_makecldf(args)
 
     def cmd_readme(self, args):
         print('gh repo edit --description "{}" --add-topic "ethnology"'.format(self.metadata.title))
@@ -326,7 +721,7 @@ class DatasetWithSocieties(BaseDataset, WithPrefix):
             super().cmd_readme(args), "\n\n![](map.png)\n\n", section='Description')
 
 
-class DatasetWithoutSocieties(BaseDataset, WithPrefix):
+class DatasetWithoutSocieties(WithProfile, WithIncrementalBuild, BaseDataset, WithPrefix):
     __society_sets__ = []
 
     def cldf_specs(self):
@@ -339,8 +734,17 @@ class DatasetWithoutSocieties(BaseDataset, WithPrefix):
             module="StructureDataset")
 
     def cmd_makecldf(self, args):
-        data_schema(args.writer.cldf, with_codes=self.raw_dir.joinpath('codes.csv').exists())
-        add_data(self.raw_dir, args.writer)
+        profiler = getattr(args, 'profiler', None)
+        with phase(profiler, 'data_schema'):
+            data_schema(args.writer.cldf, with_codes=self.raw_dir.joinpath('codes.csv').exists())
+        add_data(
+            self.raw_dir,
+            args.writer,
+            stream=getattr(args, 'stream_values', False),
+            workers=getattr(args, 'workers', 1),
+            build=getattr(args, 'build', None),
+            profiler=profiler,
+            raw_cache=getattr(args, 'raw_cache', False))
         args.writer.cldf.properties['dc:references'] = self.__society_sets__
 
     def cmd_readme(self, args):
@@ -0,0 +1,132 @@
+"""
+Export of (many) D-PLACE datasets into one SQLite database.
+
+Each dataset is exported in one transaction, using bulk inserts. Datasets are only re-exported if
+their CLDF data changed since the last export.
+
+Note: Values are joined with societies via `soc_id` only, because the values of datasets without
+societies reference societies in other datasets. This works because society IDs are unique across
+D-PLACE.
+"""
+import hashlib
+import pathlib
+import sqlite3
+import contextlib
+
+from clldutils.path import md5
+
+from pydplace.util import table_file
+
+__all__ = ['Database']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dataset (
+    id TEXT PRIMARY KEY, title TEXT, checksum TEXT);
+CREATE TABLE IF NOT EXISTS society (
+    dataset_id TEXT, id TEXT, name TEXT, glottocode TEXT, latitude REAL, longitude REAL,
+    xd_id TEXT, region TEXT, main_focal_year INTEGER,
+    PRIMARY KEY (dataset_id, id));
+CREATE TABLE IF NOT EXISTS variable (
+    dataset_id TEXT, id TEXT, name TEXT, description TEXT, type TEXT, category TEXT, unit TEXT,
+    PRIMARY KEY (dataset_id, id));
+CREATE TABLE IF NOT EXISTS code (
+    dataset_id TEXT, id TEXT, var_id TEXT, name TEXT, description TEXT, ord INTEGER,
+    PRIMARY KEY (dataset_id, id));
+CREATE TABLE IF NOT EXISTS value (
+    dataset_id TEXT, id TEXT, soc_id TEXT, var_id TEXT, code_id TEXT, value TEXT, comment TEXT,
+    source TEXT, sub_case TEXT, year TEXT,
+    PRIMARY KEY (dataset_id, id));
+CREATE INDEX IF NOT EXISTS value_var_id ON value (var_id);
+CREATE INDEX IF NOT EXISTS value_soc_id ON value (soc_id);
+CREATE INDEX IF NOT EXISTS society_id ON society (id);
+CREATE INDEX IF NOT EXISTS society_region ON society (region);
+CREATE INDEX IF NOT EXISTS society_glottocode ON society (glottocode);
+CREATE INDEX IF NOT EXISTS society_xd_id ON society (xd_id);
+CREATE VIEW IF NOT EXISTS value_full AS
+SELECT
+    v.*,
+    p.name AS var_name, p.type AS var_type,
+    c.name AS code_name, c.description AS code_description,
+    s.name AS soc_name, s.glottocode, s.latitude, s.longitude, s.xd_id, s.region
+FROM value AS v
+JOIN variable AS p ON p.dataset_id = v.dataset_id AND p.id = v.var_id
+LEFT JOIN code AS c ON c.dataset_id = v.dataset_id AND c.id = v.code_id
+LEFT JOIN society AS s ON s.id = v.soc_id;
+"""
+TABLES = {
+    'LanguageTable': (
+        'society',
+        ['id', 'name', 'glottocode', 'latitude', 'longitude', 'xd_id', 'region',
+         'main_focal_year']),
+    'ParameterTable': (
+        'variable', ['id', 'name', 'description', 'type', 'category', 'unit']),
+    'CodeTable': (
+        'code', ['id', 'parameterReference', 'name', 'description', 'ord']),
+    'ValueTable': (
+        'value',
+        ['id', 'languageReference', 'parameterReference', 'codeReference', 'value', 'comment',
+         'source', 'sub_case', 'year']),
+}
+
+
+def _checksum(cldf):
+    """
+    :return: Checksum of the metadata and data files of a CLDF dataset.
+    """
+    h = hashlib.md5()
+    for p in [cldf.tablegroup._fname] + [table_file(cldf, t) for t in cldf.tables]:
+        h.update(md5(p).encode('utf8'))
+    return h.hexdigest()
+
+
+def _sql_value(v):
+    if isinstance(v, list):
+        return '; '.join(v)
+    if v is None or isinstance(v, (str, int, float)):
+        return v
+    return str(v)  # e.g. `decimal.Decimal`
+
+
+class Database:
+    def __init__(self, fname):
+        self.fname = pathlib.Path(fname)
+
+    @contextlib.contextmanager
+    def connection(self):
+        with contextlib.closing(sqlite3.connect(str(self.fname))) as db:
+            db.executescript(SCHEMA)
+            yield db
+
+    def export(self, ds):
+        """
+        Export a D-PLACE dataset, replacing the data of a previous export.
+
+        :param ds: `cldfbench.Dataset` instance.
+        :return: Flag signaling whether the dataset was exported, i.e. whether it has changed.
+        """
+        cldf = ds.cldf_reader()
+        checksum = _checksum(cldf)
+        with self.connection() as db, db:  # We export in one transaction.
+            row = db.execute("SELECT checksum FROM dataset WHERE id = ?", (ds.id,)).fetchone()
+            if row and row[0] == checksum:
+                return False
+            for table, _ in TABLES.values():
+                db.execute("DELETE FROM {} WHERE dataset_id = ?".format(table), (ds.id,))
+            db.execute(
+                "INSERT OR REPLACE INTO dataset VALUES (?, ?, ?)",
+                (ds.id, cldf.properties.get('dc:title'), checksum))
+            for component, (table, cols) in TABLES.items():
+                if component not in cldf:
+                    continue
+                names = [
+                    cldf[component, col].name if (component, col) in cldf else None
+                    for col in cols]
+                db.executemany(
+                    "INSERT INTO {} VALUES ({})".format(table, ', '.join('?' * (len(cols) + 1))),
+                    ([ds.id] + [_sql_value(r.get(n)) if n else None for n in names]
+                     for r in cldf[component]))
+        return True
+
+    def query(self, sql, *params):
+        with self.connection() as db:
+            return db.execute(sql, params).fetchall()
@@ -4,30 +4,321 @@ level 2 (regional or subcontinental) units.
 
 See https://www.tdwg.org/standards/wgsrpd/
 """
+import json
+import time
+import sqlite3
 import pathlib
+import tempfile
+import functools
 
-import fiona
+import numpy as np
+import shapely
 from shapely.geometry import shape, Point
+from clldutils.path import md5
+
+from pydplace.util import cache_dir
+
+__all__ = ['Regions', 'RegionGrid', 'RegionCache', 'get_regions']
 
 GEOJSON = pathlib.Path(__file__).parent / 'wgsrpd_level2.geojson'
 
 
+def _read_geojson():
+    import fiona  # fiona is only needed to compile the regions, so we import it lazily.
+
+    return [
+        (dict(f.properties.items()), shape(f['geometry']))
+        for f in fiona.collection(str(GEOJSON))]
+
+
+def _read_regions(checksum):
+    """
+    Read the regions from a compiled version of the GeoJSON - i.e. WKB and a JSON properties
+    table - stored in the cache dir. If no compiled version for the current content of the
+    GeoJSON file exists, it is created.
+    """
+    compiled = cache_dir() / 'wgsrpd_level2.{}.npz'.format(checksum)
+    if compiled.exists():
+        with np.load(compiled) as data:
+            wkb = data['wkb'].tobytes()
+            offsets = data['offsets']
+            properties = json.loads(data['properties'].tobytes().decode('utf8'))
+        return list(zip(
+            properties,
+            shapely.from_wkb([wkb[start:end] for start, end in zip(offsets, offsets[1:])])))
+
+    regions = _read_geojson()
+    wkb = shapely.to_wkb([polygon for _, polygon in regions])
+    for p in compiled.parent.glob('wgsrpd_level2.*.npz'):  # Remove outdated compiled versions.
+        p.unlink()
+    # We write to a temporary file first, to not leave incomplete files around.
+    with tempfile.NamedTemporaryFile(dir=compiled.parent, suffix='.npz', delete=False) as fp:
+        np.savez(
+            fp,
+            wkb=np.frombuffer(b''.join(wkb), dtype=np.uint8),
+            offsets=np.cumsum([0] + [len(b) for b in wkb]),
+            properties=np.frombuffer(
+                json.dumps([props for props, _ in regions]).encode('utf8'), dtype=np.uint8))
+    pathlib.Path(fp.name).replace(compiled)
+    return regions
+
+
+@functools.lru_cache(maxsize=None)
+def get_regions(resolution=None):
+    """
+    :param resolution: Resolution of the `RegionGrid` to use for lookups, or `None`.
+    :return: The process-wide shared `Regions` instance.
+    """
+    return Regions(resolution=resolution)
+
+
+class RegionGrid:
+    """
+    A raster of region indices with cells of `resolution` degrees, for O(1) lookup of regions.
+
+    A cell is assigned a region only if it does not intersect any region boundary. Cells which
+    straddle a boundary or lie offshore are marked with -1; points in these cells must be matched
+    exactly.
+
+    The grid is computed once per regions data and resolution, stored as `.npy` file in the cache
+    dir and then memory-mapped.
+    """
+    def __init__(self, regions, resolution=0.05):
+        self.resolution = resolution
+        fname = cache_dir() / 'wgsrpd_level2.{}.{:g}.npy'.format(regions.checksum, resolution)
+        if not fname.exists():
+            with tempfile.NamedTemporaryFile(dir=fname.parent, suffix='.npy', delete=False) as fp:
+                np.save(fp, self.compute(regions, resolution))
+            pathlib.Path(fp.name).replace(fname)
+        self.cells = np.load(fname, mmap_mode='r')
+
+    @staticmethod
+    def compute(regions, resolution):
+        ny, nx = round(180 / resolution), round(360 / resolution)
+        # Boundaries are marked with some tolerance, to make up for rounding errors in lookups:
+        eps = resolution * 1e-6
+
+        # 1. Mark cells touched by region boundaries. Boundary segments are split into pieces no
+        # longer than half the resolution, thus the bounding box of a piece overlaps at most 2x2
+        # cells.
+        coords, line = shapely.get_coordinates(
+            shapely.get_parts(shapely.boundary([p for _, p in regions.regions])),
+            return_index=True)
+        same_line = line[1:] == line[:-1]
+        start, vector = coords[:-1][same_line], np.diff(coords, axis=0)[same_line]
+        npieces = np.maximum(
+            np.ceil(np.hypot(vector[:, 0], vector[:, 1]) / (resolution / 2)), 1).astype(int)
+        segment = np.repeat(np.arange(len(start)), npieces)
+        t = (np.arange(len(segment)) - np.repeat(np.cumsum(npieces) - npieces, npieces))
+        p0 = start[segment] + vector[segment] * (t / npieces[segment])[:, None]
+        p1 = start[segment] + vector[segment] * ((t + 1) / npieces[segment])[:, None]
+        boundary = np.zeros((ny, nx), dtype=bool)
+        for x in (np.minimum(p0, p1) - eps, np.maximum(p0, p1) + eps):
+            for y in (np.minimum(p0, p1) - eps, np.maximum(p0, p1) + eps):
+                boundary[
+                    np.clip(np.floor((y[:, 1] + 90) / resolution).astype(int), 0, ny - 1),
+                    np.clip(np.floor((x[:, 0] + 180) / resolution).astype(int), 0, nx - 1),
+                ] = True
+
+        # 2. Cells not touched by any boundary lie completely inside or outside of each region,
+        # so one point suffices to classify them. We classify whole blocks of such cells at once,
+        # recursively splitting blocks which contain boundary cells. A summed-area table allows
+        # counting the boundary cells in a block in constant time.
+        sat = np.zeros((ny + 1, nx + 1), dtype=np.int32)
+        sat[1:, 1:] = boundary.cumsum(axis=0, dtype=np.int32).cumsum(axis=1, dtype=np.int32)
+        cells = np.full((ny, nx), -1, dtype=np.int16)
+        size = 2 ** int(np.ceil(np.log2(max(nx, ny))))
+        rows, cols = np.array([0]), np.array([0])
+        while len(rows):
+            rows_end, cols_end = np.minimum(rows + size, ny), np.minimum(cols + size, nx)
+            free = (sat[rows_end, cols_end] + sat[rows, cols]) == \
+                (sat[rows, cols_end] + sat[rows_end, cols])
+            regs = regions._containing(shapely.points(
+                -180 + (cols[free] + 0.5) * resolution, -90 + (rows[free] + 0.5) * resolution))
+            for r, c, rr, cc, i in zip(
+                    rows[free], cols[free], rows_end[free], cols_end[free], regs):
+                if i >= 0:
+                    cells[r:rr, c:cc] = i
+            if size == 1:
+                break
+            size //= 2
+            rows, cols = rows[~free], cols[~free]
+            rows = np.concatenate([rows, rows, rows + size, rows + size])
+            cols = np.concatenate([cols, cols + size, cols, cols + size])
+            inside = (rows < ny) & (cols < nx)
+            rows, cols = rows[inside], cols[inside]
+        return cells
+
+    def lookup(self, lons, lats):
+        """
+        :return: Array of region indices for the coordinates, -1 for coordinates which must be \
+        matched exactly.
+        """
+        rows = np.floor((np.asarray(lats, dtype=float) + 90) / self.resolution)
+        cols = np.floor((np.asarray(lons, dtype=float) + 180) / self.resolution)
+        ny, nx = self.cells.shape
+        valid = (rows >= 0) & (rows < ny) & (cols >= 0) & (cols < nx)
+        res = np.full(len(rows), -1)
+        res[valid] = self.cells[rows[valid].astype(int), cols[valid].astype(int)]
+        return res
+
+
 class Regions:
-    def __init__(self):
-        self.regions = [
-            (dict(f.properties.items()), shape(f['geometry']))
-            for f in fiona.collection(str(GEOJSON))]
+    """
+    Regions are matched using an STRtree of prepared polygons, i.e. exact containment is only
+    tested for polygons whose bounding box contains a point.
+
+    Optionally, passing a `resolution` enables lookup of regions in a `RegionGrid` first.
+    """
+    def __init__(self, resolution=None):
+        self.checksum = md5(GEOJSON)
+        self.regions = _read_regions(self.checksum)
+        polygons = [polygon for _, polygon in self.regions]
+        shapely.prepare(polygons)
+        self.index = shapely.STRtree(polygons)
+        self.grid = RegionGrid(self, resolution) if resolution else None
+
+    @staticmethod
+    def _first(pidx, ridx):
+        """
+        Positions of the first match - i.e. the one with the smallest region index - per point in
+        the `(point index, region index)` pairs returned by STRtree queries.
+        """
+        order = np.lexsort((ridx, pidx))
+        return order[np.unique(pidx[order], return_index=True)[1]]
+
+    def _containing(self, points):
+        """
+        :return: Array with the index of the first region containing a point or -1.
+        """
+        res = np.full(len(points), -1)
+        pidx, ridx = self.index.query(points, predicate='within')
+        first = self._first(pidx, ridx)
+        res[pidx[first]] = ridx[first]
+        return res
+
+    def name(self, i):
+        return self.regions[i][0]['LEVEL2_NAM']
 
     def match(self, lon, lat):
+        """
+        :return: `(name, distance)` pair for the first region (in file order) containing the \
+        point, or for the nearest region - with distance in degrees - for offshore points.
+        """
+        if self.grid is not None:
+            i = self.grid.lookup([lon], [lat])[0]
+            if i >= 0:
+                return self.name(i), 0
+
         point = Point(lon, lat)
-        mindist, nearest = None, None
-        for feature, polygon in self.regions:
-            if polygon.contains(point):
-                return feature['LEVEL2_NAM'], 0
+        containing = self.index.query(point, predicate='within')
+        if len(containing):
+            return self.name(containing.min()), 0
+
+        nearest, distances = self.index.query_nearest(
+            point, return_distance=True, all_matches=True)
+        i = nearest.argmin()  # Ties are resolved in favour of the first region in file order.
+        return self.name(nearest[i]), float(distances[i])
+
+    def match_many(self, lons, lats):
+        """
+        Vectorized version of `Regions.match`.
+
+        :param lons: Sequence of longitudes.
+        :param lats: Sequence of latitudes.
+        :return: `list` of `(name, distance)` pairs, in the order of the input coordinates.
+        """
+        lons, lats = np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)
+        regions = self.grid.lookup(lons, lats) if self.grid is not None \
+            else np.full(len(lons), -1)
+        distances = np.zeros(len(lons))
+
+        todo = np.flatnonzero(regions < 0)
+        regions[todo] = self._containing(shapely.points(lons[todo], lats[todo]))
+
+        offshore = todo[regions[todo] < 0]
+        if len(offshore):
+            (pidx, ridx), dist = self.index.query_nearest(
+                shapely.points(lons[offshore], lats[offshore]),
+                return_distance=True,
+                all_matches=True)
+            first = self._first(pidx, ridx)
+            regions[offshore[pidx[first]]] = ridx[first]
+            distances[offshore[pidx[first]]] = dist[first]
+        return [(self.name(i), float(d)) for i, d in zip(regions, distances)]
+
+
+class RegionCache:
+    """
+    A persistent cache of region matches, keyed by coordinates rounded to `precision` decimals and
+    the checksum of the regions data.
+
+    `RegionCache` provides the same matching methods as `Regions`. The cache is stored as SQLite
+    database in the cache dir; if it grows beyond `maxsize` entries, the least recently used
+    entries are evicted.
+    """
+    def __init__(self, regions, path=None, maxsize=100000, precision=6):
+        self.regions = regions
+        self.path = pathlib.Path(path) if path else cache_dir() / 'regions.sqlite'
+        self.maxsize = maxsize
+        self.precision = precision
+
+    @functools.cached_property
+    def db(self):
+        """
+        The connection to the cache database - opened once, when first needed.
+        """
+        db = sqlite3.connect(str(self.path), timeout=30)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS region_match ("
+            "lon REAL, lat REAL, checksum TEXT, name TEXT, distance REAL, used REAL, "
+            "PRIMARY KEY (lon, lat, checksum))")
+        db.execute("CREATE INDEX IF NOT EXISTS region_match_used ON region_match (used)")
+        db.execute("CREATE TEMP TABLE region_key (lon REAL, lat REAL)")
+        return db
+
+    def close(self):
+        if 'db' in self.__dict__:
+            self.__dict__.pop('db').close()
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM region_match").fetchone()[0]
+
+    def clear(self):
+        with self.db:
+            self.db.execute("DELETE FROM region_match")
+
+    def match(self, lon, lat):
+        return self.match_many([lon], [lat])[0]
 
-            dist = point.distance(polygon)
-            if mindist is None or mindist > dist:
-                mindist, nearest = dist, feature
+    def match_many(self, lons, lats):
+        keys = [
+            (round(float(lon), self.precision), round(float(lat), self.precision))
+            for lon, lat in zip(lons, lats)]
+        now, checksum = time.time(), self.regions.checksum
+        with self.db as db:
+            # We look up all keys at once, joining with a temporary table of the keys.
+            db.execute("DELETE FROM region_key")
+            db.executemany("INSERT INTO region_key VALUES (?, ?)", set(keys))
+            join = "region_key AS k JOIN region_match AS m " \
+                "ON m.lon = k.lon AND m.lat = k.lat AND m.checksum = ?"
+            cached = {
+                (lon, lat): (name, distance) for lon, lat, name, distance in db.execute(
+                    "SELECT m.lon, m.lat, m.name, m.distance FROM " + join, (checksum,))}
+            db.execute(
+                "UPDATE region_match SET used = ? WHERE rowid IN (SELECT m.rowid FROM {})".format(
+                    join),
+                (now, checksum))
 
-        assert mindist is not None
-        return nearest['LEVEL2_NAM'], mindist
+            missing = sorted(set(keys) - set(cached))
+            if missing:
+                cached.update(zip(missing, self.regions.match_many(*zip(*missing))))
+                db.executemany(
+                    "INSERT OR REPLACE INTO region_match VALUES (?, ?, ?, ?, ?, ?)",
+                    [key + (checksum,) + cached[key] + (now,) for key in missing])
+                db.execute(
+                    "DELETE FROM region_match WHERE rowid IN "
+                    "(SELECT rowid FROM region_match ORDER BY used LIMIT max(0, "
+                    "(SELECT count(*) FROM region_match) - ?))",
+                    (self.maxsize,))
+        return [cached[key] for key in keys]
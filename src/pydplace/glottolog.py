@@ -2,19 +2,25 @@
 Recreate glottolog data files from the current version published at http://glottolog.org
 """
 import re
+import json
+import sqlite3
+import pathlib
+import tempfile
 import itertools
+import contextlib
+import collections
+import multiprocessing
 
+import newick
 from csvw.dsv import UnicodeWriter, reader
+from cldfcatalog import Repository
 from pyglottolog.api import Glottolog
-try:
-    # Compatibility with pyglottolog < 2.x
-    from pyglottolog.languoids import Level
-except ImportError:
-    Level = None
 
-from pydplace.util import remove_subdirs
+from pydplace.util import remove_subdirs, cache_dir
 
-__all__ = ['update']
+__all__ = [
+    'update', 'Languoid', 'read_languoids', 'induced_children', 'induced_tree', 'Ancestry',
+    'ancestor_index']
 
 NEXUS_TEMPLATE = """#NEXUS
 Begin trees;
@@ -23,87 +29,227 @@ end;
 """
 
 
-def write_tree(tree, fname, taxa_in_dplace, societies_by_glottocode):  # pragma: no cover
+class Languoid:
+    """
+    The data of a Glottolog languoid we use to derive D-PLACE data.
+
+    In contrast to `pyglottolog.languoids.Languoid`, level and macroareas are stored as plain
+    strings.
+    """
+    __slots__ = ('id', 'name', 'level', 'lineage', 'iso', 'macroareas', 'category', 'parent')
+
+    def __init__(self, id, name, level, lineage, iso, macroareas, category, parent):
+        self.id = id
+        self.name = name
+        self.level = level
+        self.lineage = [tuple(t) for t in lineage]
+        self.iso = iso
+        self.macroareas = macroareas
+        self.category = category
+        self.parent = parent
+
+    @classmethod
+    def from_glottolog(cls, lang):
+        return cls(
+            lang.id,
+            lang.name,
+            lang.level.name,
+            [(name, gc, level.name) for name, gc, level in lang.lineage],
+            lang.iso,
+            [getattr(ma, 'value', ma.name) for ma in lang.macroareas],
+            lang.category,
+            lang.lineage[-1][1] if lang.lineage else None,
+        )
+
+    def as_row(self):
+        return (
+            self.id,
+            self.name,
+            self.level,
+            json.dumps(self.lineage),
+            self.iso,
+            json.dumps(self.macroareas),
+            self.category,
+            self.parent)
+
+
+def _version(gl_repos):
+    """
+    :return: The `git describe` output for a clean clone of Glottolog data, else `None`.
+    """
+    repos = Repository(gl_repos, not_git_repo_ok=True)
+    if repos.repo and not repos.is_dirty():
+        return repos.describe()
+
+
+def _write_snapshot(langs, path):
+    # We write to a temporary file first, to not leave incomplete files around.
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.sqlite', delete=False) as fp:
+        pass
+    with contextlib.closing(sqlite3.connect(fp.name)) as db, db:
+        db.execute(
+            "CREATE TABLE languoid ("
+            "id TEXT PRIMARY KEY, name TEXT, level TEXT, lineage TEXT, iso TEXT, "
+            "macroareas TEXT, category TEXT, parent TEXT)")
+        db.executemany(
+            "INSERT INTO languoid VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [lang.as_row() for lang in langs])
+    pathlib.Path(fp.name).replace(path)
+
+
+def _read_snapshot(path):
+    with contextlib.closing(sqlite3.connect(str(path))) as db:
+        return [
+            Languoid(id_, name, level, json.loads(lineage), iso, json.loads(mas), cat, parent)
+            for id_, name, level, lineage, iso, mas, cat, parent
+            in db.execute("SELECT * FROM languoid ORDER BY id")]
+
+
+def read_languoids(gl_repos, version=None):
+    """
+    Read the languoids from a snapshot of the Glottolog data stored in the cache dir.
+
+    Snapshots are keyed by Glottolog version, i.e. by `version` or - if not specified - the
+    `git describe` output for the clone at `gl_repos`. If no version can be determined, the
+    languoids are read from `gl_repos` without creating a snapshot.
+
+    :return: `list` of `Languoid` objects, ordered by glottocode.
+    """
+    version = version or _version(gl_repos)
+    path = cache_dir() / 'glottolog.{}.sqlite'.format(re.sub(r'[^\w.-]', '_', version or ''))
+    if version and path.exists():
+        langs = _read_snapshot(path)
+    else:
+        langs = sorted(
+            (Languoid.from_glottolog(lang) for lang in Glottolog(gl_repos).languoids()),
+            key=lambda lang: lang.id)
+        if version:
+            _write_snapshot(langs, path)
+    return langs
+
+
+def induced_children(taxa, by_id):
+    """
+    Index the part of the Glottolog classification which is needed to construct trees of `taxa`.
+
+    Only the ancestors of `taxa` are visited, i.e. the cost is proportional to the number of taxa
+    rather than the size of the classification.
+
+    :param taxa: `set` of glottocodes.
+    :param by_id: `dict` mapping glottocodes to `Languoid` objects.
+    :return: `dict` mapping glottocodes to the `set` of their children with taxa in their subtree.
+    """
+    children = collections.defaultdict(set)
+    for gc in taxa:
+        while gc in by_id and by_id[gc].parent and gc not in children[by_id[gc].parent]:
+            children[by_id[gc].parent].add(gc)
+            gc = by_id[gc].parent
+    return children
+
+
+def induced_tree(root, taxa, by_id, children=None):
+    """
+    Construct the subtree of the Glottolog classification below `root`, induced by `taxa`.
+
+    Nodes which are not in `taxa` and have only one child in the induced tree are collapsed.
+
+    :param root: `Languoid` at the root of the subtree.
+    :param children: Result of `induced_children` for `taxa` - to be re-used for multiple roots.
+    :return: `newick.Node` labeled with glottocodes or `None` if no taxa are found below `root`.
+    """
+    children = induced_children(taxa, by_id) if children is None else children
+
+    def node(gc):
+        descendants = [
+            n for n in (node(c) for c in sorted(children.get(gc, []), key=lambda c: by_id[c].name))
+            if n]
+        if gc in taxa or len(descendants) > 1:
+            return newick.Node(gc, length='1', descendants=descendants)
+        return descendants[0] if descendants else None
+
+    return node(root.id)
+
+
+def write_tree(node, name, outdir, taxa_in_dplace):
+    """
+    :param node: `newick.Node` or `list` of `newick.Node` objects - the subtrees of an unlabeled \
+    root node. In the latter case, the Newick representation is written one subtree at a time.
+    """
+    fname = outdir / name
     if not fname.exists():
         fname.mkdir()
-    tree.prune([str(n) for n in taxa_in_dplace])
 
+    head, _, tail = NEXUS_TEMPLATE.format(name, '\0').partition('\0')
     with fname.joinpath('summary.trees').open('w', encoding="utf-8") as handle:
-        handle.write(NEXUS_TEMPLATE.format(
-            tree.name if tree.name else 'UNTITLED',
-            tree.write(format=1)
-        ))
+        handle.write(head)
+        if isinstance(node, newick.Node):
+            handle.write(newick.dumps(node))
+        else:
+            handle.write('(')
+            for i, subtree in enumerate(node):
+                handle.write((',' if i else '') + subtree.newick)
+            handle.write(');')
+        handle.write(tail)
 
     with UnicodeWriter(fname.joinpath('taxa.csv')) as writer:
         writer.writerow(['taxon', 'glottocode', 'xd_ids', 'soc_ids'])
         for gc in sorted(taxa_in_dplace):
-            # socs = societies_by_glottocode[gc]
-            writer.writerow([
-                gc,
-                gc,
-                # comma_join(sorted(set(s.xd_id for s in socs))),
-                # comma_join(sorted(s.id for s in socs))
-            ])
-    return tree
-
+            writer.writerow([gc, gc])
 
-def trees(societies_by_glottocode, langs, outdir, year, title):  # pragma: no cover
-    label_pattern = re.compile(r"'[^\[]+\[([a-z0-9]{4}[0-9]{4})[^']*'")
 
-    def rename(n):
-        n.name = label_pattern.match(n.name).groups()[0]
-        n.length = 1
+def trees(societies_by_glottocode, langs, outdir, year, title, workers=1):
+    """
+    Write the Glottolog classification of the D-PLACE societies as family trees and a global tree.
 
+    :param workers: Number of processes to use for writing the family trees.
+    """
     glottocodes = set(societies_by_glottocode.keys())
-    glottocodes_in_global_tree = set()
     index = {}
     outdir = outdir / 'phylogenies'
     remove_subdirs(outdir, 'glottolog_*')
-    languoids = {}
-    families = []
-    for lang in langs:
-        if not lang.lineage:  # a top-level node
-            if not lang.category.startswith('Pseudo '):
-                families.append(lang)
-        languoids[lang.id] = lang
-
-    glob = None  # Tree()
-    glob.name = 'glottolog_global'
+    by_id = {lang.id: lang for lang in langs}
+    families = [
+        lang for lang in langs
+        # top-level nodes
+        if not lang.parent and not lang.category.startswith('Pseudo ')]
 
+    children = induced_children(glottocodes, by_id)
+    glob, jobs = [], []
     for family in sorted(families, key=lambda f: f.name):
-        node = family.newick_node(nodes=languoids)
-        node.visit(rename)
-        taxa_in_tree = set(n.name for n in node.walk())
-        taxa_in_dplace = glottocodes.intersection(taxa_in_tree)
-        if not taxa_in_dplace:
-            continue  # pragma: no cover
-
-        tree = None  # Tree("({0});".format(node.newick), format=3)
-        tree.name = 'glottolog_{0}'.format(family.id)
-        if family.level.name == 'family':
-            tree = write_tree(tree, outdir / tree.name, taxa_in_dplace, societies_by_glottocode)
-            glottocodes_in_global_tree = glottocodes_in_global_tree.union(
-                set(n.name for n in tree.traverse()))
-            index[tree.name] = dict(
-                id=tree.name,
+        node = induced_tree(family, glottocodes, by_id, children=children)
+        if not node:
+            continue
+        glob.append(node)
+
+        if family.level == 'family':
+            name = 'glottolog_{0}'.format(family.id)
+            jobs.append((node, name, outdir, {n.name for n in node.walk()} & glottocodes))
+            index[name] = dict(
+                id=name,
                 name='{0} ({1})'.format(family.name, title),
                 author='{0} ({1})'.format(title, family.name),
                 year=year,
                 scaling='',
                 reference=None,
                 url='https://glottolog.org/resource/languoid/id/{}'.format(family.id))
-        else:
-            glottocodes_in_global_tree = glottocodes_in_global_tree.union(taxa_in_tree)
-        glob.add_child(tree)
+
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            pool.starmap(write_tree, jobs)
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            write_tree(*job)
 
     # global
     write_tree(
         glob,
-        outdir / glob.name,
-        glottocodes_in_global_tree.intersection(glottocodes),
-        societies_by_glottocode)
-    index[glob.name] = dict(
-        id=glob.name,
+        'glottolog_global',
+        outdir,
+        {n.name for node in glob for n in node.walk()} & glottocodes)
+    index['glottolog_global'] = dict(
+        id='glottolog_global',
         name='Global Classification ({0})'.format(title),
         author=title,
         year=year,
@@ -111,59 +257,78 @@ def trees(societies_by_glottocode, langs, outdir, year, title):  # pragma: no co
         reference=None,
         url='https://glottolog.org/')
 
+    # Merge with the existing index, sorting by ID, so the result doesn't depend on previous runs.
     index_path = outdir / 'index.csv'
     phylos = list(reader(index_path, dicts=True))
+    header = list(phylos[0].keys())
+    rows = {phylo['id']: list(phylo.values()) for phylo in phylos}
+    rows.update({id_: [spec.get(k, '') for k in header] for id_, spec in index.items()})
     with UnicodeWriter(index_path) as writer:
-        header = list(phylos[0].keys())
         writer.writerow(header)
-        for phylo in sorted(phylos, key=lambda p: tuple(p.values())):
-            if phylo['id'] in index:
-                writer.writerow([index[phylo['id']].get(k, '') for k in header])
-                del index[phylo['id']]
-            else:
-                writer.writerow(list(phylo.values()))
+        writer.writerows(row for _, row in sorted(rows.items()))
 
-        for id_, spec in sorted(index.items()):
-            writer.writerow([spec.get(k, '') for k in header])
 
+class Ancestry(collections.namedtuple('Ancestry', 'language family lineage')):
+    """
+    :ivar language: Glottocode of the language a languoid belongs to - i.e. the languoid itself \
+    for languages, the language-level ancestor for dialects - or `None`.
+    :ivar family: The top-level `Languoid` of the classification a languoid belongs to or `None` \
+    for top-level languoids.
+    :ivar lineage: `tuple` of the glottocodes of the ancestors of a languoid, top-down.
+    """
 
-def languoids(api, langs, outdir):  # pragma: no cover
-    _Level = Level or api.languoid_levels
+
+def ancestor_index(langs):
+    """
+    Compute the `Ancestry` of all languoids in one top-down pass over the classification.
+
+    :param langs: Complete `list` of `Languoid` objects of a Glottolog version.
+    :return: `dict` mapping glottocodes to `Ancestry`.
+    """
+    children = collections.defaultdict(list)
+    for lang in langs:
+        children[lang.parent].append(lang)
+
+    index = {}
+    todo = [(lang, Ancestry(None, None, ())) for lang in children[None]]
+    while todo:
+        lang, parent = todo.pop()
+        if lang.level == 'language':
+            language = lang.id
+        elif lang.level == 'dialect':
+            language = parent.language
+        else:
+            language = None
+        index[lang.id] = anc = Ancestry(language, parent.family, parent.lineage)
+        child_anc = Ancestry(language, parent.family or lang, anc.lineage + (lang.id,))
+        todo.extend((child, child_anc) for child in children[lang.id])
+    return index
+
+
+def languoids(langs, outdir):
+    index = ancestor_index(langs)
     with UnicodeWriter(outdir / 'csv' / 'glottolog.csv') as writer:
         writer.writerow([
             'id', 'name', 'family_id', 'family_name', 'iso_code', 'language_id', 'macroarea',
             'lineage', 'level'])
-        for lang in sorted(langs, key=lambda l_: l_.id):
-            if lang.level == _Level.language:
-                lid = lang.id
-            elif lang.level == _Level.dialect:
-                for _, lid, level in reversed(lang.lineage):
-                    if level == _Level.language:
-                        break
-                else:  # pragma: no cover
-                    raise ValueError
-            else:
-                lid = None
-            writer.writerow([
-                lang.id,
-                lang.name,
-                lang.lineage[0][1] if lang.lineage else '',
-                lang.lineage[0][0] if lang.lineage else '',
-                lang.iso or '',
-                lid,
-                getattr(lang.macroareas[0], 'value', lang.macroareas[0].name)
-                if lang.macroareas else '',
-                '/'.join(gc for _, gc, _ in lang.lineage),
-                lang.level.name,
-            ])
-
-
-def update(repos, gl_repos, year, title):  # pragma: no cover
+        writer.writerows([
+            lang.id,
+            lang.name,
+            index[lang.id].family.id if index[lang.id].family else '',
+            index[lang.id].family.name if index[lang.id].family else '',
+            lang.iso or '',
+            index[lang.id].language,
+            lang.macroareas[0] if lang.macroareas else '',
+            '/'.join(index[lang.id].lineage),
+            lang.level,
+        ] for lang in sorted(langs, key=lambda l_: l_.id))
+
+
+def update(repos, gl_repos, year, title, version=None, workers=1):  # pragma: no cover
     societies_by_glottocode = {
         gc: list(socs) for gc, socs in itertools.groupby(
             sorted(repos.societies.values(), key=lambda s: s.glottocode),
             lambda s: s.glottocode)}
-    api = Glottolog(gl_repos)
-    langs = list(api.languoids())
-    languoids(api, langs, repos.repos)
-    trees(societies_by_glottocode, langs, repos.repos, year, title)
+    langs = read_languoids(gl_repos, version=version)
+    languoids(langs, repos.repos)
+    trees(societies_by_glottocode, langs, repos.repos, year, title, workers=workers)
@@ -0,0 +1,108 @@
+"""
+Instrumentation of the phases of CLDF creation, see `dplace makecldf --profile`.
+"""
+import time
+import cProfile
+import contextlib
+import tracemalloc
+
+from clldutils import jsonlib
+
+__all__ = ['Profiler', 'phase']
+
+
+class Profiler:
+    """
+    Records wall time, row counts and peak memory of named phases.
+
+    Phases may be entered repeatedly - in which case time and rows are summed up - and may be
+    nested, e.g. sources are looked up while values are converted.
+
+    Peak memory is the maximal size of the memory allocated by Python while in a phase, as traced
+    with `tracemalloc`. Tracing is started when the `Profiler` is created, and stopped when it is
+    closed. Note that tracing slows down memory allocation considerably.
+
+    :ivar phases: `dict` mapping phase names to `dict`s of stats.
+    """
+    def __init__(self, cprofile=None):
+        """
+        :param cprofile: Name of a phase to run `cProfile` for.
+        """
+        self.phases = {}
+        self.cprofile = cprofile
+        self.cprofile_stats = cProfile.Profile() if cprofile else None
+        # Peaks of the open phases, innermost last:
+        self._peaks = []
+        self._tracing = not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+
+    def close(self):
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @contextlib.contextmanager
+    def phase(self, name, rows=None):
+        """
+        Context manager to record a phase.
+
+        :param rows: Number of rows processed in the phase. Can also be set by assigning to the \
+        'rows' key of the `dict` returned by the context manager.
+        """
+        counts = dict(rows=rows)
+        stats = self.phases.setdefault(name, dict(seconds=0.0, rows=None, peak_memory=None))
+        if self._peaks:  # We must not lose the peak of the enclosing phase when resetting it.
+            self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._peaks.append(0)
+        if name == self.cprofile:
+            self.cprofile_stats.enable()
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            stats['seconds'] += time.perf_counter() - start
+            if name == self.cprofile:
+                self.cprofile_stats.disable()
+            if counts['rows'] is not None:
+                stats['rows'] = (stats['rows'] or 0) + counts['rows']
+            peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            stats['peak_memory'] = max(stats['peak_memory'] or 0, peak)
+
+    def report(self):
+        """
+        :return: `dict` mapping phase names to `dict`s with keys "seconds", "rows", \
+        "rows_per_second" and "peak_memory" (in bytes).
+        """
+        return {
+            name: dict(
+                seconds=round(stats['seconds'], 4),
+                rows=stats['rows'],
+                rows_per_second=round(stats['rows'] / stats['seconds'])
+                if stats['rows'] and stats['seconds'] else None,
+                peak_memory=stats['peak_memory'])
+            for name, stats in self.phases.items()}
+
+    def write(self, fname, **props):
+        """
+        Write the report as JSON to `fname` - and the `cProfile` stats to `<fname>.prof`.
+        """
+        jsonlib.dump(dict(props, phases=self.report()), fname, indent=4)
+        if self.cprofile_stats:
+            self.cprofile_stats.dump_stats('{}.prof'.format(fname))
+
+
+def phase(profiler, name, rows=None):
+    """
+    Record a phase if `profiler` is not `None`.
+    """
+    return profiler.phase(name, rows=rows) if profiler else contextlib.nullcontext(dict(rows=rows))
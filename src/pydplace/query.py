@@ -0,0 +1,184 @@
+"""
+Querying the values of many D-PLACE datasets by cross-dataset society ID (xd_id).
+
+For each dataset an index of the ValueTable is stored in the cache dir: A `numpy` array of
+(xd_id, Var_ID, byte offset) triples, sorted by xd_id and Var_ID. The index is memory-mapped, so
+a query only reads the matching rows from the CSV file - rather than the full table. (For zipped
+ValueTables, offsets are positions in the uncompressed data, and the file is decompressed up to
+the last matching row.)
+
+Note: Values are linked to xd_ids via their Soc_ID, using `cross_dataset_ids.json`, so this also
+works for datasets without societies.
+"""
+import csv
+import json
+import bisect
+import shutil
+import hashlib
+import pathlib
+import tempfile
+import functools
+import collections
+
+import numpy as np
+from clldutils import jsonlib
+from clldutils.path import md5
+
+from pydplace.util import cache_dir, table_file, open_table_file
+from pydplace.dataset import XD_IDS, get_xd_ids
+
+__all__ = ['Match', 'ValueIndex', 'CrossDatasetIndex']
+
+DTYPE = np.dtype([('xd', 'i4'), ('var', 'i4'), ('offset', 'i8')])
+Match = collections.namedtuple('Match', 'dataset xd_id value')
+
+
+def _iter_rows(fp):
+    """
+    :return: Generator of pairs `(offset, row)` for the rows of a CSV file opened in binary mode.
+    """
+    pos = fp.tell()
+
+    def lines():
+        nonlocal pos
+        for line in fp:
+            pos += len(line)
+            yield line.decode('utf-8-sig')
+
+    reader = csv.reader(lines())
+    while True:
+        # The reader only consumes the lines of one row at a time, so `pos` is the row's offset:
+        start = pos
+        try:
+            yield start, next(reader)
+        except StopIteration:
+            return
+
+
+class ValueIndex:
+    """
+    Index of the ValueTable of a CLDF dataset by xd_id and Var_ID.
+
+    The index is created (or updated) in the cache dir when first accessed.
+    """
+    def __init__(self, cldf):
+        """
+        :param cldf: `pycldf.Dataset` instance.
+        """
+        self.fname = table_file(cldf, cldf['ValueTable']).resolve()
+        self.soc_col = cldf['ValueTable', 'languageReference'].name
+        self.var_col = cldf['ValueTable', 'parameterReference'].name
+        self.dir = cache_dir() / 'value_index' / hashlib.md5(str(self.fname).encode()).hexdigest()
+
+    def _signature(self):
+        stat = self.fname.stat()
+        return [stat.st_size, stat.st_mtime_ns, md5(XD_IDS)]
+
+    @functools.cached_property
+    def _data(self):
+        signature = self._signature()
+        meta = jsonlib.load(self.dir / 'meta.json') if self.dir.exists() else None
+        if not meta or meta['signature'] != signature:
+            self._create(signature)
+            meta = jsonlib.load(self.dir / 'meta.json')
+        meta['var_index'] = {k: i for i, k in enumerate(meta['var_ids'])}
+        return meta, np.load(self.dir / 'index.npy', mmap_mode='r')
+
+    def _create(self, signature):
+        xd_ids, rows = get_xd_ids(), []
+        with open_table_file(self.fname) as fp:
+            it = _iter_rows(fp)
+            _, header = next(it)
+            soc, var = header.index(self.soc_col), header.index(self.var_col)
+            for offset, row in it:
+                if row[soc] in xd_ids:
+                    rows.append((xd_ids[row[soc]], row[var], offset))
+
+        xds, vars_ = sorted({r[0] for r in rows}), sorted({r[1] for r in rows})
+        xd_index = {k: i for i, k in enumerate(xds)}
+        var_index = {k: i for i, k in enumerate(vars_)}
+        index = np.array(
+            [(xd_index[xd], var_index[var], offset) for xd, var, offset in rows], dtype=DTYPE)
+        index = index[np.lexsort((index['offset'], index['var'], index['xd']))]
+
+        # We write to a temporary directory first, to not leave incomplete indexes around.
+        self.dir.parent.mkdir(exist_ok=True)
+        tmp = pathlib.Path(tempfile.mkdtemp(dir=self.dir.parent))
+        np.save(tmp / 'index.npy', index)
+        with tmp.joinpath('meta.json').open('w') as fp:
+            json.dump(dict(signature=signature, header=header, xd_ids=xds, var_ids=vars_), fp)
+        if self.dir.exists():
+            shutil.rmtree(self.dir)
+        tmp.rename(self.dir)
+
+    def offsets(self, xd_id, var_ids=None):
+        """
+        :return: `list` of byte offsets of the rows for society `xd_id` and variables `var_ids`.
+        """
+        meta, index = self._data
+        i = bisect.bisect_left(meta['xd_ids'], xd_id)
+        if i == len(meta['xd_ids']) or meta['xd_ids'][i] != xd_id:
+            return []
+        rows = index[np.searchsorted(index['xd'], i):np.searchsorted(index['xd'], i, 'right')]
+        if var_ids is not None:
+            var_index = meta['var_index']
+            rows = rows[np.isin(rows['var'], [var_index[v] for v in var_ids if v in var_index])]
+        return rows['offset'].tolist()
+
+    def rows(self, offsets):
+        """
+        :return: Generator of `dict`s for the rows at `offsets` (in order of the offsets).
+        """
+        header = self._data[0]['header']
+        with open_table_file(self.fname) as fp:
+            for offset in sorted(offsets):
+                fp.seek(offset)
+                yield dict(zip(header, next(_iter_rows(fp))[1]))
+
+    def values(self, xd_id, var_ids=None):
+        """
+        :return: Generator of `dict`s for the ValueTable rows for society `xd_id`.
+        """
+        return self.rows(self.offsets(xd_id, var_ids=var_ids))
+
+
+class CrossDatasetIndex:
+    """
+    Query the values of many datasets by xd_id.
+
+    Datasets are only opened - and their indexes only created or loaded - when queried.
+    """
+    def __init__(self, datasets):
+        """
+        :param datasets: Iterable of `cldfbench.Dataset` instances.
+        """
+        self.datasets = {ds.id: ds for ds in datasets}
+        self._indexes = {}
+
+    def __getitem__(self, dataset_id):
+        if dataset_id not in self._indexes:
+            self._indexes[dataset_id] = ValueIndex(self.datasets[dataset_id].cldf_reader())
+        return self._indexes[dataset_id]
+
+    def query(self, xd_id, var_ids=None):
+        """
+        :return: Generator of `Match` objects for the values of society `xd_id` in all datasets.
+        """
+        return self.batch([(xd_id, var_ids)])
+
+    def batch(self, queries):
+        """
+        Answer a batch of queries, reading the rows of each dataset in one sequential pass.
+
+        :param queries: Iterable of pairs `(xd_id, var_ids)`, with `var_ids` being `None` or a \
+        list of variable IDs to restrict the results.
+        :return: Generator of `Match` objects, ordered by dataset and position in the ValueTable.
+        """
+        queries = list(queries)
+        for dataset_id in self.datasets:
+            index, xd_ids = self[dataset_id], {}
+            for xd_id, var_ids in queries:
+                for offset in index.offsets(xd_id, var_ids=var_ids):
+                    xd_ids[offset] = xd_id
+            for offset, row in zip(sorted(xd_ids), index.rows(xd_ids)):
+                yield Match(dataset_id, xd_ids[offset], row)
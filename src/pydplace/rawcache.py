@@ -0,0 +1,136 @@
+"""
+A columnar cache of parsed raw CSV files.
+
+Parsing large CSV files with `csvw` dominates the time needed to re-build datasets. So we store
+parsed tables in the cache dir in a columnar format: For each column the distinct values are
+stored as JSON list and the rows as `numpy` array of indices into these lists. The index array is
+memory-mapped when reading from the cache, and rows share the (deduplicated) value objects.
+
+Cached tables are keyed by the MD5 hash of the CSV file. To not have to compute the hash each
+time, the hashes are recorded together with size and mtime of the files.
+"""
+import json
+import array
+import shutil
+import pathlib
+import tempfile
+import itertools
+
+import numpy as np
+from csvw import dsv
+from clldutils import jsonlib
+from clldutils.path import md5
+
+from pydplace.util import cache_dir
+
+__all__ = ['CachedTable', 'read_csv', 'iter_csv']
+
+CHUNKSIZE = 65536
+
+
+def _dir():
+    res = cache_dir() / 'raw_csv'
+    res.mkdir(exist_ok=True)
+    return res
+
+
+class CachedTable:
+    """
+    A table read from the columnar cache.
+
+    :ivar header: `list` of column names.
+    """
+    def __init__(self, d):
+        d = pathlib.Path(d)
+        meta = jsonlib.load(d / 'meta.json')
+        self.header = meta['header']
+        self.uniques = [meta['uniques'][col] for col in self.header]
+        self.indices = np.load(d / 'indices.npy', mmap_mode='r')
+
+    def __len__(self):
+        return self.indices.shape[0]
+
+    def iterdicts(self, start=0, end=None):
+        """
+        :return: Generator of `dict`s for the rows from `start` to `end`.
+        """
+        end = len(self) if end is None else min(end, len(self))
+        header, uniques = self.header, self.uniques
+        for s in range(start, end, CHUNKSIZE):
+            for row in self.indices[s:min(s + CHUNKSIZE, end)].tolist():
+                yield dict(zip(header, [values[i] for values, i in zip(uniques, row)]))
+
+    @classmethod
+    def create(cls, fname, d):
+        """
+        Parse the CSV file `fname` with `csvw` and store it in directory `d`.
+
+        :return: `CachedTable` or `None`, if the table cannot be stored in columnar format.
+        """
+        header, uniques, indices = None, None, array.array('i')
+        for row in dsv.reader(fname, dicts=True):
+            if None in row:
+                return None  # Rows with additional fields.
+            if header is None:
+                header = list(row)
+                uniques = [{} for _ in header]
+            indices.extend([u.setdefault(v, len(u)) for u, v in zip(uniques, row.values())])
+        if header is None:
+            return None  # We leave empty files to csvw.
+
+        # We write to a temporary directory first, to not leave incomplete caches around.
+        tmp = pathlib.Path(tempfile.mkdtemp(dir=d.parent))
+        jsonlib.dump(
+            dict(header=header, uniques={col: list(u) for col, u in zip(header, uniques)}),
+            tmp / 'meta.json')
+        np.save(
+            tmp / 'indices.npy', np.frombuffer(indices, dtype=np.int32).reshape(-1, len(header)))
+        if d.exists():  # pragma: no cover
+            shutil.rmtree(tmp)  # Another process was faster.
+        else:
+            tmp.rename(d)
+        return cls(d)
+
+
+def read_csv(fname):
+    """
+    Read a CSV file from the cache - creating the cache if needed.
+
+    :return: `CachedTable` or `None` if the file cannot be cached.
+    """
+    fname = pathlib.Path(fname).resolve()
+    stat = fname.stat()
+    signature = [stat.st_size, stat.st_mtime_ns]
+    index_path = _dir() / 'index.json'
+    index = jsonlib.load(index_path) if index_path.exists() else {}
+
+    key = str(fname)
+    if index.get(key, [None])[:2] == signature:
+        checksum = index[key][2]
+    else:
+        checksum = md5(fname)
+        old = index.get(key, [None, None, None])[2]
+        index[key] = signature + [checksum]
+        if old and old != checksum and old not in {v[2] for v in index.values()}:
+            shutil.rmtree(_dir() / old, ignore_errors=True)  # Remove outdated cached version.
+        with tempfile.NamedTemporaryFile(
+                'w', dir=index_path.parent, suffix='.json', delete=False) as fp:
+            json.dump(index, fp)
+        pathlib.Path(fp.name).replace(index_path)
+
+    d = _dir() / checksum
+    if d.joinpath('meta.json').exists():
+        return CachedTable(d)
+    return CachedTable.create(fname, d)
+
+
+def iter_csv(fname, cache=False, start=0, end=None):
+    """
+    :param cache: Flag signaling whether to use the columnar cache.
+    :return: Generator of `dict`s for the rows of a CSV file, like `csvw.dsv.reader(dicts=True)`.
+    """
+    table = read_csv(fname) if cache else None
+    if table:
+        yield from table.iterdicts(start, end)
+    else:
+        yield from itertools.islice(dsv.reader(fname, dicts=True), start, end)
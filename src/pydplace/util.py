@@ -1,10 +1,17 @@
+import os
+import mmap
 import shutil
 import pathlib
+import zipfile
 import functools
+import contextlib
 
+import platformdirs
 from clldutils.text import split_text
 
-__all__ = ['split', 'comma_split', 'semicolon_split', 'remove_subdirs']
+__all__ = [
+    'split', 'comma_split', 'semicolon_split', 'remove_subdirs', 'cache_dir', 'csv_chunks',
+    'table_file', 'open_table_file']
 
 
 comma_split = functools.partial(split_text, separators=',', strip=True, brackets={})
@@ -16,3 +23,85 @@ def remove_subdirs(d, pattern='*'):
     for sd in pathlib.Path(d).glob(pattern):
         if sd.is_dir():
             shutil.rmtree(str(sd))
+
+
+def table_file(cldf, table):
+    """
+    :return: Path of the file of a table of a CLDF dataset - which may be zipped, like `csvw` \
+    supports.
+    """
+    fname = pathlib.Path(table.url.resolve(cldf.directory))
+    if fname.exists():
+        return fname
+    zipped = fname.parent / '{}.zip'.format(fname.name)
+    if zipped.exists():
+        return zipped
+    raise FileNotFoundError('{} does not exist'.format(fname))
+
+
+@contextlib.contextmanager
+def open_table_file(fname):
+    """
+    Open a - possibly zipped - table file for reading in binary mode.
+
+    Note: Seeking backwards in a zipped file means decompressing it again from the start.
+    """
+    fname = pathlib.Path(fname)
+    if fname.suffix == '.zip':
+        with zipfile.ZipFile(fname) as zf, zf.open(fname.stem) as fp:
+            yield fp
+    else:
+        with fname.open('rb') as fp:
+            yield fp
+
+
+def cache_dir():
+    """
+    Directory for data derived from package data, which can be re-created at any time.
+
+    Defaults to the user cache dir, but can be configured via the environment variable
+    `PYDPLACE_CACHE_DIR`.
+    """
+    res = pathlib.Path(
+        os.environ.get('PYDPLACE_CACHE_DIR') or platformdirs.user_cache_dir('pydplace'))
+    res.mkdir(parents=True, exist_ok=True)
+    return res
+
+
+def csv_chunks(fname, chunksize):
+    """
+    Split the data rows of a CSV file into byte ranges of roughly `chunksize` bytes.
+
+    Since quoted values may contain newlines, a newline only ends a row if it is preceded by an
+    even number of quote characters.
+
+    :return: pair `(header, chunks)` of the header row as `bytes` and a `list` of `(start, end)` \
+    byte offsets.
+    """
+    with pathlib.Path(fname).open('rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b'', []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            def count_quotes(start, end, block=1024 * 1024):
+                return sum(
+                    m[i:min(i + block, end)].count(b'"') for i in range(start, end, block))
+
+            def row_end(start, pos):
+                # `start` must be the start of a row.
+                quotes = count_quotes(start, pos)
+                while True:
+                    nl = m.find(b'\n', pos)
+                    if nl == -1:
+                        return len(m)
+                    quotes += count_quotes(pos, nl)
+                    if quotes % 2 == 0:
+                        return nl + 1
+                    pos = nl + 1
+
+            header_end = row_end(0, 0)
+            chunks, start = [], header_end
+            while start < len(m):
+                end = row_end(start, min(start + chunksize, len(m)))
+                chunks.append((start, end))
+                start = end
+            return m[:header_end], chunks
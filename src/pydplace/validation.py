@@ -0,0 +1,435 @@
+"""
+In-process validation of D-PLACE datasets.
+
+`pycldf.Dataset.validate` reads each table several times - to validate rows, to check primary keys
+and to check referential integrity. `Validator` runs these checks - and the D-PLACE specific checks
+- in a single pass over the rows of each table.
+"""
+import csv
+import time
+import random
+import tempfile
+import pathlib
+import operator
+import itertools
+import contextlib
+import collections
+
+import numpy as np
+from csvw.dsv import UnicodeReaderWithLineNumber
+from csvw.metadata import TableGroup
+from cldfbench.dataset import get_dataset
+from pycldf.util import pkg_path, MD_SUFFIX
+from pycldf.terms import TERMS
+from pycldf.validators import DatasetValidator
+
+from pydplace.dataset import DatasetWithSocieties, DatasetWithoutSocieties
+
+__all__ = ['Validator']
+
+# CLDF properties needed for the consistency checks of ValueTable rows, keyed by component:
+CONSISTENCY_COLUMNS = {
+    'ValueTable': ['languageReference', 'parameterReference', 'codeReference', 'value'],
+    'ParameterTable': ['id', 'type'],
+    'CodeTable': ['id', 'parameterReference'],
+    'LanguageTable': ['id'],
+}
+# Maximal number of line numbers listed for an error reported for many rows:
+MAX_LINES = 10
+
+
+class _FailLog:
+    """
+    Logger passed to csvw, to turn problems when reading rows into validation errors.
+    """
+    def __init__(self, fail):
+        self.fail = fail
+
+    def warning(self, msg, *args):
+        self.fail(msg % args if args else msg)
+
+    error = warning
+
+
+def _cached_read(read, maxsize=10000):
+    """
+    Most columns in D-PLACE datasets have few distinct values - e.g. Var_ID or Code_ID in
+    ValueTable - so we memoize the comparatively expensive conversion of cell values.
+    """
+    cache = {}
+
+    def _read(v, strict=True):
+        try:
+            res = cache[v, strict]
+        except KeyError:
+            res = read(v, strict=strict)
+            if len(cache) < maxsize:
+                cache[v, strict] = res
+        # List-valued cells must not share the list object.
+        return list(res) if isinstance(res, list) else res
+    return _read
+
+
+def _factorize(values):
+    """
+    :return: pair `(uniques, inverse)` of numpy arrays, such that `uniques[inverse]` are the \
+    `values` - with `None` replaced by the empty string.
+    """
+    return np.unique(
+        np.array(['' if v is None else v for v in values], dtype=str), return_inverse=True)
+
+
+def _groups(keys, rows):
+    """
+    Group rows by key, via sorting.
+
+    :param keys: Array of keys for all rows.
+    :param rows: Array of indices of the rows to group.
+    :return: Generator of pairs `(key, row indices)`.
+    """
+    rows = rows[np.argsort(keys[rows], kind='stable')]
+    if len(rows):
+        for group in np.split(rows, np.flatnonzero(np.diff(keys[rows])) + 1):
+            yield keys[group[0]], group
+
+
+def _format_lines(lines, n):
+    """
+    :param lines: The first line numbers of the `n` rows an error is reported for.
+    """
+    res = ','.join(str(i) for i in lines[:MAX_LINES])
+    return res + ',... ({} rows)'.format(n) if n > MAX_LINES else res
+
+
+def _is_number(s):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
+def _iter_csv(table, fname, dialect, stack):
+    """
+    Read the rows of a CSV file without any conversion.
+
+    :return: Generator of pairs `(lineno, row)`, with line numbers as reported by csvw.
+    """
+    if dialect.commentPrefix or dialect.skipRows or dialect.skipColumns or \
+            dialect.skipBlankRows or not fname.exists():
+        # We leave the special cases to csvw.
+        yield from table._get_csv_reader(fname, dialect, stack)
+        return
+    f = stack.enter_context(fname.open(encoding='utf-8-sig', newline=''))
+    reader = csv.reader(f, **dialect.as_python_formatting_parameters())
+    for row in reader:
+        yield reader.line_num, row
+
+
+class Validator(DatasetValidator):
+    """
+    :ivar errors: `list` of error messages.
+    :ivar warnings: `list` of warning messages.
+    :ivar timings: `dict` mapping check names to the time spent running the check in seconds.
+    """
+    def __init__(self, ds, log=None, validators=None, fast=False, sample=None, seed=0):
+        """
+        :param fast: If `True`, only the metadata and required files are checked.
+        :param sample: If a positive integer, only a random sample of this size of the ValueTable \
+        rows is validated.
+        :param seed: Seed for the random number generator used for sampling.
+        """
+        self.ds = ds
+        self.fast, self.sample, self.seed = fast, sample, seed
+        self.errors, self.warnings = [], []
+        self.timings = collections.OrderedDict()
+        super().__init__(
+            dataset=ds.cldf_reader(), terms=TERMS, log=log, row_validators=validators or [])
+
+    def fail(self, reason):
+        self.success = False
+        self.errors.append(reason)
+
+    def warn(self, msg, *args):
+        self.warnings.append(msg % args if args else msg)
+        super().warn(msg, *args)
+
+    @contextlib.contextmanager
+    def timed(self, check):
+        start = time.perf_counter()
+        yield
+        self.timings[check] = self.timings.get(check, 0) + time.perf_counter() - start
+
+    def __call__(self):
+        with self.timed('metadata'):
+            self._validate_metadata()
+        if self.fast:
+            return self.success
+        with self.timed('schema'):
+            for default_table in self._default_tables():
+                self._validate_default_objects(default_table)
+            for table in self.dataset.tables:
+                self._validate_table_schema(table)
+                self._validate_columns(table)
+            try:
+                fks = self.dataset.tablegroup.validate_schema()
+            except ValueError as e:
+                self.fail(str(e))
+                fks = []
+
+        # Distinct values of referenced columns, keyed by `(table, colref)`:
+        targets = {(fk.target_table.local_name, fk.pk): set() for fk in fks}
+        # Distinct values of foreign keys, mapped to `[fname, first line numbers, number of rows]`:
+        refs = [(fk, {}) for fk in fks]
+        # Columns needed for the consistency checks, keyed by component:
+        columns = {}
+        for component, props in CONSISTENCY_COLUMNS.items():
+            if component in self.dataset:
+                columns[component] = {
+                    prop: [] for prop in props if self.dataset.get((component, prop))}
+                columns[component]['lineno'] = []
+        for table in self.dataset.tables:
+            fname = pathlib.Path(table.url.resolve(table._parent.base))
+            if not (fname.exists() or fname.parent.joinpath(fname.name + '.zip').exists()):
+                self.fail('{} does not exist'.format(fname))
+                continue
+            self._validate_table_rows(
+                table,
+                {pk: values for (t, pk), values in targets.items() if t == table.local_name},
+                [(fk, r) for fk, r in refs if fk.source_table.local_name == table.local_name],
+                next((c for n, c in columns.items() if self.dataset[n] is table), {}))
+
+        with self.timed('foreign keys'):
+            for fk, values in refs:
+                pks = targets[(fk.target_table.local_name, fk.pk)]
+                for vals, (fname, lines, n) in values.items():
+                    if vals not in pks:
+                        self.fail('{}:{} {} not found in table {}'.format(
+                            fname, _format_lines(lines, n), vals, fk.target_table.url))
+
+        with self.timed('components'):  # E.g. MediaTable and TreeTable.
+            self._validate_components()
+
+        with self.timed('consistency'):
+            if 'ValueTable' in columns:
+                self._validate_consistency(columns)
+        return self.success
+
+    def _default_tables(self):
+        return TableGroup.from_file(
+            pkg_path('modules', '{}{}'.format(self.dataset.module, MD_SUFFIX))).tables
+
+    def _validate_table_rows(self, table, targets, refs, columns):
+        """
+        :param targets: `dict` to collect distinct values of columns referenced in foreign keys.
+        :param refs: `list` of foreign keys and `dict` to collect distinct values of the foreign \
+        key columns.
+        :param columns: `dict` mapping CLDF properties to `list` to collect column values.
+        """
+        validators = [
+            (col, v) for col in table.tableSchema.columns for table_, col_, v in self.row_validators
+            if (not table_ or table is self.dataset.get(table_))
+            and col is self.dataset.get((table, col_))]  # noqa: W503
+        get_pk = operator.itemgetter(*table.tableSchema.primaryKey) \
+            if table.tableSchema.primaryKey else None
+        getters = {pk: operator.itemgetter(*pk) for pk in targets}
+        fk_getters = [(fk, operator.itemgetter(*fk.fk), values) for fk, values in refs]
+        column_getters = [
+            (self.dataset[table, prop].name, values)
+            for prop, values in columns.items() if prop != 'lineno']
+        source_col = None
+        if table is self.dataset.get('ValueTable'):
+            source_col = self.dataset.get(('ValueTable', 'source'))
+
+        for col in table.tableSchema.columns:
+            col.read = _cached_read(col.read)
+
+        pks, timings = set(), collections.Counter()
+
+        def lap(check, start):
+            now = time.perf_counter()
+            timings[check] += now - start
+            return now
+
+        t = time.perf_counter()
+        if self.sample and table is self.dataset.get('ValueTable'):
+            rows = self._iter_sample(table)
+        else:
+            rows = table.iterdicts(log=_FailLog(self.fail), with_metadata=True)
+        for fname, lineno, row in rows:
+            t = lap('read', t)
+            for col, validate in validators:
+                try:
+                    validate(self.dataset, table, col, row)
+                except ValueError as e:
+                    self.fail('{}:{}:{} {}'.format(fname.name, lineno, col.name, e))
+            t = lap('row validators', t)
+
+            if get_pk:
+                pk = get_pk(row)
+                if pk in pks:
+                    self.fail('{}:{} duplicate primary key: {}'.format(fname.name, lineno, pk))
+                pks.add(pk)
+            for pk, getter in getters.items():
+                targets[pk].add(getter(row))
+            for fk, getter, values in fk_getters:
+                vals = getter(row)
+                if vals is not None:
+                    # List-valued foreign keys must reference a row for each value.
+                    for val in (vals if isinstance(vals, list) and len(fk.fk) == 1 else [vals]):
+                        # We record the number of rows and the first line numbers per value.
+                        loc = values.get(val)
+                        if loc is None:
+                            values[val] = [fname.name, [lineno], 1]
+                        else:
+                            loc[2] += 1
+                            if loc[2] <= MAX_LINES:
+                                loc[1].append(lineno)
+            if columns:
+                columns['lineno'].append(lineno)
+                for name, values in column_getters:
+                    values.append(row[name])
+            t = lap('keys', t)
+
+            if source_col:
+                srcs = row[source_col.name] or []
+                if len(srcs) != len(set(srcs)):
+                    self.fail('{}:{} {} duplicate reference'.format(fname.name, lineno, srcs))
+            t = lap('duplicate references', t)
+        lap('read', t)
+
+        for check, secs in timings.items():
+            self.timings[check] = self.timings.get(check, 0) + secs
+
+    def _iter_sample(self, table):
+        """
+        Draw a reproducible random sample of rows via reservoir sampling over the CSV rows, and
+        read only these rows according to the table schema.
+        """
+        fname = pathlib.Path(table.url.resolve(table._parent.base))
+        dialect = table._get_dialect()
+        rng, sample = random.Random(self.seed), []
+        with contextlib.ExitStack() as stack:
+            reader = _iter_csv(table, fname, dialect, stack)
+            header = next(reader)[1] if dialect.header else None
+            for i, (lineno, row) in enumerate(reader):
+                if i < self.sample:
+                    sample.append((i, lineno, row))
+                else:
+                    j = rng.randint(0, i)
+                    if j < self.sample:
+                        sample[j] = (i, lineno, row)
+        sample.sort()
+
+        # Write the sample to a CSV file, to read it via csvw:
+        with tempfile.TemporaryDirectory() as tmp:
+            sample_fname = pathlib.Path(tmp) / fname.name
+            with sample_fname.open('w', encoding='utf8', newline='') as f:
+                writer = csv.writer(f, **dialect.as_python_formatting_parameters())
+                if header:
+                    writer.writerow(header)
+                writer.writerows(row for _, _, row in sample)
+            with UnicodeReaderWithLineNumber(sample_fname, dialect=dialect) as reader:
+                linenos = {
+                    ln: lineno for (ln, _), (_, lineno, _) in zip(
+                        itertools.islice(reader, 1 if header else 0, None), sample)}
+
+            def fail(msg):
+                # Report problems with the location in the original file:
+                ln, _, rem = msg[len(str(sample_fname)) + 1:].partition(':')
+                self.fail('{}:{}:{}'.format(fname, linenos[int(ln)], rem))
+
+            for _, ln, row in table.iterdicts(
+                    log=_FailLog(fail), with_metadata=True, fname=sample_fname):
+                yield fname, linenos[ln], row
+
+    def _society_ids(self, columns):
+        """
+        :return: `set` of valid society IDs, or `None` if no check is necessary or possible.
+        """
+        if 'LanguageTable' in columns:
+            return None  # Soc_ID is a foreign key to LanguageTable in this case.
+        res = set()
+        for spec in self.dataset.properties.get('dc:references') or []:
+            ds = get_dataset(spec)
+            if not ds:
+                self.warn('Society set %s not found - Soc_ID not checked', spec)
+                return None
+            res |= {r['ID'] for r in ds.cldf_reader()['LanguageTable']}
+        return res
+
+    def _validate_consistency(self, columns):
+        """
+        Check consistency of Soc_ID, Var_ID, Code_ID and Value in ValueTable.
+
+        Since these columns have few distinct values, we check distinct values (or pairs) only and
+        map invalid ones back to the rows via numpy arrays.
+        """
+        values = columns['ValueTable']
+        lineno = np.array(values['lineno'])
+        fname = self.dataset['ValueTable'].url.string
+
+        def report(keys, rows, msg):
+            for key, group in _groups(keys, rows):
+                self.fail('{}:{} {}'.format(
+                    fname, _format_lines(lineno[group[:MAX_LINES]], len(group)), msg(key)))
+
+        params = columns.get('ParameterTable', {})
+        continuous = {
+            pid for pid, type_ in zip(params.get('id', []), params.get('type', []))
+            if type_ == 'Continuous'}
+        codes = columns.get('CodeTable', {})
+        code_vars = dict(zip(codes.get('id', []), codes.get('parameterReference', [])))
+
+        var_u, var_i = _factorize(values['parameterReference'])
+        code_u, code_i = _factorize(values.get('codeReference', [None] * len(lineno)))
+        # Join Var_ID and Code_ID into one integer key:
+        pair_u, pair_i = np.unique(var_i * len(code_u) + code_i, return_inverse=True)
+        pairs = list(zip(var_u[pair_u // len(code_u)], code_u[pair_u % len(code_u)]))
+        invalid = np.array([
+            bool(code) and (var in continuous or (code in code_vars and code_vars[code] != var))
+            for var, code in pairs], dtype=bool)
+        report(
+            pair_i,
+            np.flatnonzero(invalid[pair_i]),
+            lambda k: 'Code_ID {1} for continuous variable {0}'.format(*pairs[k])
+            if pairs[k][0] in continuous
+            else 'Code_ID {1} does not belong to Var_ID {0}'.format(*pairs[k]))
+
+        if continuous:
+            value_u, value_i = _factorize(values['value'])
+            invalid = np.array([bool(v) and not _is_number(v) for v in value_u], dtype=bool)
+            report(
+                value_i,
+                np.flatnonzero(invalid[value_i] & np.isin(var_u, list(continuous))[var_i]),
+                lambda k: 'non-numeric Value {} for continuous variable'.format(value_u[k]))
+
+        societies = self._society_ids(columns)
+        if societies is not None:
+            soc_u, soc_i = _factorize(values['languageReference'])
+            invalid = ~np.isin(soc_u, list(societies))
+            report(
+                soc_i,
+                np.flatnonzero(invalid[soc_i]),
+                lambda k: 'Soc_ID {} not found in referenced society sets'.format(soc_u[k]))
+
+    def _validate_metadata(self):
+        if not self.ds.id.startswith('dplace-dataset-'):
+            self.fail('Invalid dataset ID: {}'.format(self.ds.id))
+        title = self.dataset.properties.get('dc:title')
+        if not (title or '').startswith('D-PLACE dataset derived from'):
+            self.fail('Invalid dataset title in CLDF: {}'.format(title))
+
+        if isinstance(self.ds, DatasetWithoutSocieties):
+            if not self.ds.__society_sets__:
+                self.fail('Dataset without societies must reference at lease one society set')
+            if not self.dataset.properties.get('dc:references'):
+                self.fail('Referenced society sets not yet in CLDF. Re-run makecldf')
+        else:
+            assert isinstance(self.ds, DatasetWithSocieties)
+            if not self.ds.dir.joinpath('map.png').exists():
+                self.fail('map.png not found')
+
+        for fname in ['metadata.json', 'CONTRIBUTORS.md', '.zenodo.json']:
+            if not self.ds.dir.joinpath(fname).exists():
+                self.fail('{} not found'.format(fname))
@@ -1,9 +1,16 @@
 import shutil
 import pathlib
+import zipfile
 
 import pytest
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('PYDPLACE_CACHE_DIR', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+
 @pytest.fixture
 def tests_dir():
     return pathlib.Path(__file__).parent
@@ -19,3 +26,21 @@ def dataset_with_societies(tmp_path, tests_dir):
 def dataset_without_societies(tmp_path, tests_dir):
     shutil.copytree(tests_dir / 'dataset_without_societies', tmp_path / 'dataset_without_societies')
     return tmp_path / 'dataset_without_societies' / 'cldfbench_test2.py'
+
+
+@pytest.fixture
+def dataset_with_zipped_values(dataset_with_societies):
+    """
+    A dataset with societies, configured to write the ValueTable as zip archive.
+    """
+    dataset_with_societies.write_text(dataset_with_societies.read_text(encoding='utf8') + """
+    def cldf_specs(self):
+        spec = super().cldf_specs()
+        spec.zipped = {'ValueTable'}
+        return spec
+""", encoding='utf8')
+    data = dataset_with_societies.parent / 'cldf' / 'data.csv'
+    with zipfile.ZipFile(str(data) + '.zip', 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.write(data, arcname=data.name)
+    data.unlink()
+    return dataset_with_societies
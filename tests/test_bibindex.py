@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from pydplace.bibindex import BibIndex
+
+BIB = """\
+% a comment
+@string{pub = "Publisher"}
+@Book{Key1,
+    title = {Title, with comma},
+    publisher = pub,
+}
+@comment{ignored}
+@article{key2,
+    title = {@article{no, entry}
+}
+@article{KEY1,
+    title = {Duplicate}
+}
+"""
+
+
+def test_BibIndex(tmp_path):
+    p = tmp_path / 'sources.bib'
+    p.write_text(BIB, encoding='utf8')
+    bib = BibIndex(p)
+    assert len(bib) == 2
+    assert bib.index.exists() and not tmp_path.joinpath('sources.bib.idx').exists()
+    assert 'key1' in bib and 'Key2' in bib and 'no' not in bib
+    src = bib['Key1']
+    assert src.id == 'Key1'
+    assert src.genre == 'book'
+    assert src['title'] == 'Title, with comma'
+    assert src['publisher'] == 'Publisher'
+    with pytest.raises(ValueError):
+        _ = bib['x']
+
+    # The index is re-used ...
+    bib.index.write_text(bib.index.read_text().replace('key2', 'key3'))
+    assert 'key3' in BibIndex(p)
+    # ... unless the BibTeX file changed.
+    p.write_text(BIB + '@misc{key3,\n}\n', encoding='utf8')
+    os.utime(p, ns=(0, 0))
+    assert len(BibIndex(p)) == 3
+
+
+def test_BibIndex_empty(tmp_path):
+    assert len(BibIndex(tmp_path / 'sources.bib')) == 0
+    tmp_path.joinpath('sources.bib').write_text('')
+    assert len(BibIndex(tmp_path / 'sources.bib')) == 0
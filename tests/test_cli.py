@@ -1,9 +1,13 @@
+import json
 import logging
 
 import pytest
 
 from cldfbench.__main__ import main as cldfbenchmain
 from pydplace.__main__ import main
+from pydplace.bibindex import BibIndex
+from pydplace.build import manifest_path
+from pydplace.commands.glottologbib import parse_lgcode
 
 
 def test_help(capsys):
@@ -35,6 +39,39 @@ def test_check(capsys, dataset_with_societies, dataset_without_societies):
     assert 'Re-run' in out
     assert 'duplicate reference' in out
 
+    main(['check', str(dataset_without_societies), '--fast'])
+    out, _ = capsys.readouterr()
+    assert 'duplicate reference' not in out and 'metadata.json not found' in out
+
+    main(['check', str(dataset_without_societies), '--sample', '20'])
+    out, _ = capsys.readouterr()
+    assert 'duplicate reference' in out
+
+
+def test_check_batch(capsys, tmp_path, dataset_with_societies, dataset_without_societies):
+    broken = dataset_with_societies.parent.parent / 'broken'
+    broken.mkdir()
+    broken.joinpath('cldfbench_broken.py').write_text(
+        dataset_with_societies.read_text(encoding='utf8'), encoding='utf8')
+    md = dataset_without_societies.parent / 'cldf' / 'StructureDataset-metadata.json'
+    md.write_text(
+        md.read_text(encoding='utf8').replace('"primaryKey": [', '"primaryKey": ["Value", ', 1),
+        encoding='utf8')
+
+    res = main([
+        'check', str(dataset_with_societies), str(dataset_without_societies),
+        str(broken / 'cldfbench_broken.py'),
+        '--workers', '2', '--report', str(tmp_path / 'r.json')])
+    assert res == 1
+    out, _ = capsys.readouterr()
+    assert out.count('FAIL') == 3
+    assert 'composite primary key' in out
+    report = json.loads(tmp_path.joinpath('r.json').read_text(encoding='utf8'))
+    assert not report['passed']
+    assert len(report['datasets']) == 3
+    assert 'foreign keys' in report['datasets'][0]['timings']
+    assert 'FileNotFoundError' in report['datasets'][2]['errors'][0]
+
 
 def test_readme(dataset_with_societies, dataset_without_societies):
     cldfbenchmain(['readme', str(dataset_with_societies)])
@@ -55,6 +92,194 @@ def test_makecldf(capsys, dataset_with_societies, dataset_without_societies, tes
         'makecldf', str(dataset_without_societies), '--glottolog', str(tests_dir / 'gl_repos')])
 
 
-def test_glottologbib():
-    pass
-    #main(['--repos', str(repos.repos), 'glottologbib'])
+def test_makecldf_region_cache(dataset_with_societies, tests_dir, cache_dir):
+    def makecldf(*opts):
+        main([
+            'makecldf', str(dataset_with_societies),
+            '--glottolog', str(tests_dir / 'gl_repos')] + list(opts),
+            log=logging.getLogger(__name__))
+
+    makecldf('--no-region-cache')
+    assert not cache_dir.joinpath('regions.sqlite').exists()
+    makecldf()
+    assert cache_dir.joinpath('regions.sqlite').exists()
+    makecldf('--clear-region-cache')
+    assert dataset_with_societies.parent.joinpath('cldf', 'societies.csv').exists()
+
+
+def test_makecldf_values_options(dataset_with_societies, dataset_without_societies, tests_dir):
+    for ds in [dataset_with_societies, dataset_without_societies]:
+        cldfbenchmain(['makecldf', str(ds), '--glottolog', str(tests_dir / 'gl_repos')])
+        data = ds.parent.joinpath('cldf', 'data.csv').read_text(encoding='utf8')
+        sources = ds.parent.joinpath('cldf', 'sources.bib').read_text(encoding='utf8')
+        for opts in [
+            ['--stream-values'], ['--workers', '2'], ['--stream-values', '--workers', '2'],
+            ['--raw-cache'], ['--raw-cache', '--workers', '2'],
+        ]:
+            main(
+                ['makecldf', str(ds), '--glottolog', str(tests_dir / 'gl_repos')] + opts,
+                log=logging.getLogger(__name__))
+            assert ds.parent.joinpath('cldf', 'data.csv').read_text(encoding='utf8') == data
+            assert ds.parent.joinpath('cldf', 'sources.bib').read_text(encoding='utf8') == sources
+
+
+def test_makecldf_profile(dataset_with_societies, dataset_without_societies, tests_dir, tmp_path):
+    for ds, opts in [
+        (dataset_with_societies, ['--cprofile', 'values']),
+        (dataset_without_societies, ['--stream-values']),
+    ]:
+        main(
+            ['makecldf', str(ds), '--glottolog', str(tests_dir / 'gl_repos'),
+             '--profile', str(tmp_path / 'profile.json')] + opts,
+            log=logging.getLogger(__name__))
+        report = json.loads(tmp_path.joinpath('profile.json').read_text(encoding='utf8'))
+        assert report['phases']['write']['rows'] > report['phases']['parameters']['rows'] > 0
+    assert 'societies' not in report['phases']
+    assert tmp_path.joinpath('profile.json.prof').exists()
+
+    # Phases of incremental builds:
+    for _ in range(2):
+        main(
+            ['makecldf', str(dataset_with_societies), '--glottolog', str(tests_dir / 'gl_repos'),
+             '--profile', str(tmp_path / 'profile.json'), '--incremental'],
+            log=logging.getLogger(__name__))
+    report = json.loads(tmp_path.joinpath('profile.json').read_text(encoding='utf8'))
+    assert 'values' not in report['phases'] and 'local_makecldf' in report['phases']
+
+
+def test_makecldf_profile_zipped(dataset_with_zipped_values, tests_dir, tmp_path):
+    main(
+        ['makecldf', str(dataset_with_zipped_values), '--glottolog', str(tests_dir / 'gl_repos'),
+         '--profile', str(tmp_path / 'profile.json')],
+        log=logging.getLogger(__name__))
+    cldf_dir = dataset_with_zipped_values.parent / 'cldf'
+    assert cldf_dir.joinpath('data.csv.zip').exists() and not cldf_dir.joinpath('data.csv').exists()
+    report = json.loads(tmp_path.joinpath('profile.json').read_text(encoding='utf8'))
+    assert report['phases']['write']['rows'] > report['phases']['values']['rows']
+
+
+def test_makecldf_incremental(dataset_with_societies, dataset_without_societies, tests_dir):
+    def makecldf(ds, *opts):
+        main(
+            ['makecldf', str(ds), '--glottolog', str(tests_dir / 'gl_repos')] + list(opts),
+            log=logging.getLogger(__name__))
+        return {
+            p.name: p.read_text(encoding='utf8')
+            for p in ds.parent.joinpath('cldf').iterdir() if p.suffix in {'.csv', '.bib'}}
+
+    for ds in [dataset_with_societies, dataset_without_societies]:
+        full = makecldf(ds)
+        assert makecldf(ds, '--incremental') == full
+        assert manifest_path(ds.parent / 'cldf').exists()
+        assert not ds.parent.joinpath('cldf', '.makecldf.json').exists()
+        # Changes to the output invalidate the manifest:
+        out = ds.parent / 'cldf' / 'data.csv'
+        out.write_text(out.read_text(encoding='utf8').replace('WNAI8', 'WNAI9'), encoding='utf8')
+        assert makecldf(ds, '--incremental') == full
+
+        # Change one input file:
+        data = ds.parent / 'raw' / 'data.csv'
+        data.write_text(
+            data.read_text(encoding='utf8').replace('NA,WNAI8,2', 'NA,WNAI8,1'), encoding='utf8')
+        incremental = makecldf(ds, '--incremental')
+        assert incremental != full
+        assert incremental == makecldf(ds)
+
+    raw = dataset_with_societies.parent / 'raw'
+    for fname, old, new in [
+        ('sources.bib', '{1960}', '{1961}'),
+        ('variables.csv', 'Blue oak', 'Blue Oak'),
+        ('societies.csv', 'Tlingit', 'Tlinkit'),
+    ]:
+        makecldf(dataset_with_societies, '--incremental')
+        raw.joinpath(fname).write_text(
+            raw.joinpath(fname).read_text(encoding='utf8').replace(old, new), encoding='utf8')
+        assert makecldf(dataset_with_societies, '--incremental', '--workers', '2') == \
+            makecldf(dataset_with_societies)
+
+
+def test_makecldf_incremental_custom(dataset_with_societies, tests_dir, caplog):
+    code = dataset_with_societies.read_text(encoding='utf8')
+    dataset_with_societies.write_text(
+        code + '\n    def local_makecldf(self, args):\n        pass\n', encoding='utf8')
+    main(
+        ['makecldf', str(dataset_with_societies), '--glottolog', str(tests_dir / 'gl_repos'),
+         '--incremental'],
+        log=logging.getLogger(__name__))
+    assert 'No incremental build' in caplog.text
+    assert not manifest_path(dataset_with_societies.parent / 'cldf').exists()
+
+
+def test_glottologbib(tmp_path, dataset_with_societies, dataset_without_societies):
+    bib = dataset_with_societies.parent / 'raw' / 'sources.bib'
+    orig = BibIndex(bib)
+    lgcodes = {key: orig[key].get('lgcode') for key in orig.entries}
+    # lgcode lists societies from all D-PLACE datasets, which must survive:
+    main(['glottologbib', str(dataset_with_societies)], log=logging.getLogger(__name__))
+    bibindex = BibIndex(bib)
+    for key, lgcode in lgcodes.items():
+        if lgcode:
+            assert parse_lgcode(lgcode) <= parse_lgcode(bibindex[key]['lgcode'])
+    assert 'Aztec [clas1250]' in bibindex['murdock1934b']['lgcode']
+
+    # The first entry's lgcode lacks a society from the data, the second entry has no lgcode:
+    bib.write_text(
+        bib.read_text(encoding='utf8').replace(
+            'lgcode = {North Tlingit [tlin1245], South', 'lgcode = {South', 1).replace(
+            '    lgcode = {Haisla [hais1244], North Tlingit [tlin1245], South Tlingit [tlin1245], '
+            'Tsimshian [nucl1649]},\n', '', 1),
+        encoding='utf8')
+    main(['glottologbib', str(dataset_with_societies)], log=logging.getLogger(__name__))
+    for key in ['delaguna1960', 'barnett1968']:
+        assert BibIndex(bib)[key]['lgcode'] == 'North Tlingit [tlin1245], South Tlingit [tlin1245]'
+
+    # Re-running doesn't touch the file:
+    mtime = bib.stat().st_mtime_ns
+    main(['glottologbib', str(dataset_with_societies)], log=logging.getLogger(__name__))
+    assert bib.stat().st_mtime_ns == mtime
+
+    # Datasets without societies get them from the referenced society sets:
+    bib2 = dataset_without_societies.parent / 'raw' / 'sources.bib'
+    mtime = bib2.stat().st_mtime_ns
+    main(['glottologbib', str(dataset_without_societies)], log=logging.getLogger(__name__))
+    assert bib2.stat().st_mtime_ns == mtime
+    md = dataset_without_societies.parent / 'cldf' / 'StructureDataset-metadata.json'
+    metadata = json.loads(md.read_text(encoding='utf8'))
+    metadata['dc:references'] = [str(dataset_with_societies), 'x']
+    md.write_text(json.dumps(metadata), encoding='utf8')
+    bibfile = tmp_path / 'dplace.bib'
+    bibfile.write_text('@misc{delaguna1960}\n\n@book{barnett1968,\n}', encoding='utf8')
+    main(
+        ['glottologbib', str(dataset_without_societies), '--bibfile', str(bibfile)],
+        log=logging.getLogger(__name__))
+    assert bibfile.read_text(encoding='utf8').count('lgcode = {') == 2
+
+    bib.unlink()
+    main(['glottologbib', str(dataset_with_societies)], log=logging.getLogger(__name__))
+
+
+def test_sqlite(tmp_path, caplog, dataset_with_societies, dataset_without_societies):
+    db = tmp_path / 'dplace.sqlite'
+    with caplog.at_level(logging.INFO):
+        main(['sqlite', str(db), str(dataset_with_societies)], log=logging.getLogger(__name__))
+        main(['sqlite', str(db), str(dataset_with_societies)], log=logging.getLogger(__name__))
+    assert 'exported' in caplog.text and 'unchanged' in caplog.text
+    assert db.exists()
+
+    db = tmp_path / 'dplace2.sqlite'
+    main(['sqlite', str(db), str(dataset_without_societies)], log=logging.getLogger(__name__))
+    assert db.exists()
+
+
+def test_query(capsys, tmp_path, dataset_with_societies):
+    queries = tmp_path / 'queries.csv'
+    queries.write_text('xd_id,Var_ID\nxd1082,WNAI8\nxd1068,\n', encoding='utf8')
+    main(
+        ['query', str(dataset_with_societies), '--xd-id', 'xd1431', '--var', 'WNAI8',
+         '--queries', str(queries)],
+        log=logging.getLogger(__name__))
+    out, _ = capsys.readouterr()
+    rows = out.strip().splitlines()
+    assert rows[0].startswith('dataset,xd_id,ID,Soc_ID')
+    assert {row.split(',')[1] for row in rows[1:]} == {'xd1431', 'xd1082', 'xd1068'}
+    assert sum(1 for row in rows if ',WNAI1,' in row) == 1
@@ -1,10 +1,14 @@
+import pickle
 import shutil
 import pathlib
 import argparse
+import collections
 
 import pytest
+from cldfbench.datadir import DataDir
 
-from pydplace.dataset import DatasetWithSocieties, DatasetWithoutSocieties
+from pydplace.dataset import (
+    DatasetWithSocieties, DatasetWithoutSocieties, iter_value_batches, Value, value)
 
 
 @pytest.fixture
@@ -22,3 +26,76 @@ def test_DatasetWithSocieties(ds_with_dir):
     ds._cmd_makecldf(argparse.Namespace())
 
     assert ds.with_prefix('x') == 'TESTx'
+
+
+def test_add_society(ds_with_dir):
+    class DS(DatasetWithSocieties):
+        id = 'dplace-dataset-test'
+        dir = ds_with_dir
+
+    writer = argparse.Namespace(objects=collections.defaultdict(list))
+    DS().add_society(writer, ID='x', Longitude=13.4, Latitude=52.5)
+    assert writer.objects['LanguageTable'][0]['region'] == 'Middle Europe'
+
+
+def test_lazy_enrichment_data(ds_with_dir):
+    class DS(DatasetWithSocieties):
+        id = 'dplace-dataset-test'
+        dir = ds_with_dir
+
+    ds = DS()
+    assert 'regions' not in vars(ds) and 'xd_ids' not in vars(ds)
+    assert ds.xd_ids is DS().xd_ids
+    with pytest.raises(TypeError):
+        ds.xd_ids['x'] = 'y'
+    assert ds.regions.regions is DS().regions.regions
+
+
+def test_iter_value_batches(ds_with_dir):
+    raw_dir = DataDir(ds_with_dir / 'raw')
+    codes = {('1', '1'): 'x'}
+    batches = list(iter_value_batches(raw_dir, codes))
+    pbatches = list(iter_value_batches(raw_dir, codes, workers=2, chunksize=300))
+    assert len(pbatches) < len(batches)
+    assert [v for _, values in pbatches for v in values] == \
+        [v for _, values in batches for v in values]
+    assert list(dict.fromkeys(k for keys, _ in pbatches for k in keys)) == \
+        list(dict.fromkeys(k for keys, _ in batches for k in keys))
+    assert not any(
+        values for _, values in iter_value_batches(raw_dir, codes, workers=2, with_values=False))
+
+
+def test_Value():
+    v = Value(ID='1', Source=('a',), x='y')
+    assert v == dict(Value(ID='1', Source=('a',)), x='y')
+    assert v.get('x') == v['x'] == 'y' and v.get('z', 5) == 5 and 'Value' in repr(v)
+    with pytest.raises(KeyError):
+        _ = v['z']
+    del v['x']
+    del v['ID']
+    with pytest.raises(KeyError):
+        del v['x']
+    with pytest.raises(KeyError):
+        del v['ID']
+    with pytest.raises(KeyError):
+        _ = v['ID']
+    v['z'] = 3
+    assert 'ID' not in v and v.get('ID', 5) == 5 and 'ID' not in list(v)
+    assert len(v) == 11 and v['z'] == 3
+    assert pickle.loads(pickle.dumps(v)) == v
+    v['ID'] = '2'
+    assert v['ID'] == '2' and len(v) == 12
+    assert Value().get('z') is None
+
+
+def test_value():
+    row = dict(
+        var_id='v', code='1', soc_id='s', comment='', references='a; b', sub_case='',
+        source_coded_data='', admin_comment='', year='NA')
+    v1, v2 = value(0, row, {}), value(1, row, {})
+    v1['Source'].append('c')
+    assert v1['Source'] == ['a', 'b', 'c'] and v2['Source'] == ['a', 'b']
+
+    # Missing trailing fields are passed through as None:
+    row.update(source_coded_data=None, admin_comment=None, year=None)
+    assert value(0, row, {})['source_coded_data'] is None
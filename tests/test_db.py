@@ -0,0 +1,46 @@
+import zipfile
+
+import pytest
+
+from cldfbench.dataset import dataset_from_module
+
+from pydplace.db import Database
+
+
+def test_Database(tmp_path, dataset_with_societies):
+    ds = dataset_from_module(dataset_with_societies)
+    db = Database(tmp_path / 'db.sqlite')
+    assert db.export(ds)
+    assert not db.export(ds)
+    assert db.query(
+        "SELECT soc_name, xd_id, region, code_name FROM value_full "
+        "WHERE soc_id = ? AND var_id = ?",
+        'WNAI1', 'WNAI8',
+    ) == [('North Tlingit', 'xd1431', 'Subarctic America', 'Northwest conifers')]
+    assert db.query("SELECT category FROM variable WHERE id = 'WNAI8'") == \
+        [('Ecology: vegetation; Ecology: overview',)]
+
+    data = ds.cldf_dir / 'data.csv'
+    lines = data.read_text(encoding='utf8').splitlines()
+    data.write_text('\n'.join(lines[:-1]), encoding='utf8')
+    assert db.export(ds)
+    assert db.query("SELECT count(*) FROM value") == [(len(lines) - 2,)]
+
+
+def test_Database_zipped(tmp_path, dataset_with_zipped_values):
+    ds = dataset_from_module(dataset_with_zipped_values)
+    db = Database(tmp_path / 'db.sqlite')
+    assert db.export(ds)
+    assert db.query("SELECT count(*) FROM value") == [(12,)]
+
+    data = ds.cldf_dir / 'data.csv.zip'
+    with zipfile.ZipFile(data) as zf:
+        lines = zf.read('data.csv').decode('utf8').splitlines()
+    with zipfile.ZipFile(data, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('data.csv', '\n'.join(lines[:-1]))
+    assert db.export(ds)
+    assert db.query("SELECT count(*) FROM value") == [(11,)]
+
+    data.unlink()
+    with pytest.raises(FileNotFoundError):
+        db.export(ds)
@@ -12,3 +12,67 @@ def test_match():
     region, dist = reg.match(0, 0)
     assert region == 'West Tropical Africa'
     assert dist > 0
+
+
+@pytest.mark.parametrize('lon,lat', [(0, 0), (13.4, 52.5), (-70, -80), (179.9, -17), (150, 50)])
+def test_match_like_linear_scan(lon, lat):
+    reg = geo.Regions()
+    point = geo.Point(lon, lat)
+    for feature, polygon in reg.regions:
+        if polygon.contains(point):
+            expected = feature['LEVEL2_NAM'], 0
+            break
+    else:
+        expected = min(
+            ((f['LEVEL2_NAM'], point.distance(p)) for f, p in reg.regions), key=lambda i: i[1])
+    assert reg.match(lon, lat) == expected
+
+
+def test_match_many():
+    reg = geo.Regions()
+    coords = [(0, 0), (13.4, 52.5), (-70, -80), (179.9, -17), (150, 50)]
+    assert reg.match_many(*zip(*coords)) == [reg.match(*c) for c in coords]
+    assert reg.match_many([], []) == []
+
+
+def test_compiled_regions(cache_dir):
+    cache_dir.mkdir()
+    cache_dir.joinpath('wgsrpd_level2.outdated.npz').write_bytes(b'')
+    reg = geo.Regions()
+    assert len(list(cache_dir.glob('wgsrpd_level2.*.npz'))) == 1
+    compiled = geo.Regions()
+    assert [p for p, _ in compiled.regions] == [p for p, _ in reg.regions]
+    assert all(a.equals_exact(b, 0) for (_, a), (_, b) in zip(compiled.regions, reg.regions))
+    assert geo.get_regions() is geo.get_regions()
+
+
+def test_RegionCache(tmp_path, mocker):
+    connect = mocker.spy(geo.sqlite3, 'connect')
+    reg = geo.get_regions()
+    cache = geo.RegionCache(reg, path=tmp_path / 'cache.sqlite', maxsize=3)
+    coords = [(0, 0), (13.4, 52.5), (13.4, 52.5), ('-70', '-80')]
+    assert cache.match_many(*zip(*coords)) == reg.match_many(*zip(*coords))
+    assert len(cache) == 3
+    assert cache.match(150, 50) == reg.match(150, 50)
+    assert len(cache) == 3
+    assert cache.match(0, 0) == reg.match(0, 0)
+    cache.clear()
+    assert len(cache) == 0
+    assert connect.call_count == 1
+    cache.close()
+    cache.close()
+    assert cache.match(0, 0) == reg.match(0, 0)
+    assert connect.call_count == 2
+
+
+def test_RegionGrid(cache_dir):
+    reg = geo.Regions(resolution=1)
+    assert len(list(cache_dir.glob('*.1.npy'))) == 1
+    assert geo.RegionGrid(reg, 1).cells.shape == (180, 360)
+    coords = [(0, 0), (13.4, 52.5), (-70, -80), (179.9, -17), (150, 50), (180, 0), (-200, 0)]
+    exact = geo.Regions()
+    assert reg.match_many(*zip(*coords)) == exact.match_many(*zip(*coords))
+    assert [reg.match(*c) for c in coords] == [exact.match(*c) for c in coords]
+    cells = reg.grid.lookup(*zip(*coords))
+    assert cells[1] >= 0 and reg.name(cells[1]) == 'Middle Europe'
+    assert cells[0] == -1 and cells[-1] == -1
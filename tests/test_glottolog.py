@@ -1,8 +1,94 @@
-from pathlib import Path
+import shutil
 
-from pydplace.glottolog import *
+import git
+import newick
+from csvw.dsv import reader
 
+from pydplace.glottolog import (
+    read_languoids, languoids, induced_tree, trees, ancestor_index)
 
-def test_update():
-    pass
-    #update(repos, Path(__file__).parent / 'gl_repos', '2018', 'the glottolog')
+
+def test_read_languoids(tests_dir, cache_dir, mocker):
+    langs = read_languoids(tests_dir / 'gl_repos')
+    assert not list(cache_dir.glob('glottolog.*'))
+    assert len(langs) == 11
+    assert read_languoids(tests_dir / 'gl_repos', version='v5.0')[0].as_row() == langs[0].as_row()
+    assert cache_dir.joinpath('glottolog.v5.0.sqlite').exists()
+
+    mocker.patch('pydplace.glottolog.Glottolog', side_effect=ValueError)
+    snapshot = {lang.id: lang for lang in read_languoids(tests_dir / 'gl_repos', version='v5.0')}
+    assert [lang.as_row() for lang in snapshot.values()] == [lang.as_row() for lang in langs]
+    assert snapshot['abcd1234'].level == 'dialect'
+
+
+def test_read_languoids_version(tmp_path, tests_dir, cache_dir):
+    shutil.copytree(tests_dir / 'gl_repos', tmp_path / 'gl')
+    repo = git.Repo.init(str(tmp_path / 'gl'))
+    repo.git.add('.')
+    repo.git.execute(
+        ['git', '-c', 'user.name=x', '-c', 'user.email=x@example.org', 'commit', '-m', 'init'])
+    repo.git.tag('v5.1')
+    assert len(read_languoids(tmp_path / 'gl')) == 11
+    assert cache_dir.joinpath('glottolog.v5.1.sqlite').exists()
+
+
+def test_languoids(tmp_path, tests_dir):
+    tmp_path.joinpath('csv').mkdir()
+    languoids(read_languoids(tests_dir / 'gl_repos'), tmp_path)
+    rows = {r['id']: r for r in reader(tmp_path / 'csv' / 'glottolog.csv', dicts=True)}
+    assert rows['abcd1234']['language_id'] != 'abcd1234'
+    assert rows['abcd1234']['family_id'] == 'yeni1252'
+
+
+def test_ancestor_index(tests_dir):
+    index = ancestor_index(read_languoids(tests_dir / 'gl_repos'))
+    assert index['abcd1234'].language == 'yugh1239'
+    assert index['abcd1234'].family.name == 'Yeniseian'
+    assert index['abcd1234'].lineage == ('yeni1252', 'nort2746', 'yugh1239')
+    assert index['nort2746'].language is None
+    assert index['yeni1252'].family is None
+
+
+def test_induced_tree(tests_dir):
+    langs = {lang.id: lang for lang in read_languoids(tests_dir / 'gl_repos')}
+    assert newick.dumps(induced_tree(langs['yeni1252'], {'abcd1234', 'kett1243'}, langs)) == \
+        '(kett1243:1,abcd1234:1)nort2746:1;'
+    assert newick.dumps(induced_tree(langs['yeni1252'], {'abcd1234', 'yugh1239'}, langs)) == \
+        '(abcd1234:1)yugh1239:1;'
+    assert induced_tree(langs['isol1234'], {'abcd1234'}, langs) is None
+
+
+def test_trees(tmp_path, tests_dir):
+    tmp_path.joinpath('phylogenies', 'glottolog_old').mkdir(parents=True)
+    tmp_path.joinpath('phylogenies', 'index.csv').write_text(
+        'id,name,author,year,scaling,reference,url\nx,x,x,2000,,,\n'
+        'glottolog_yeni1252,x,x,2000,,,\n', encoding='utf8')
+    trees(
+        {gc: [] for gc in ['isol1234', 'kett1243', 'arin1243', 'pump1237']},
+        read_languoids(tests_dir / 'gl_repos'),
+        tmp_path,
+        '2024',
+        'Glottolog 5.0')
+    phylos = tmp_path / 'phylogenies'
+    assert not phylos.joinpath('glottolog_old').exists()
+    assert 'tree glottolog_yeni1252 = (kett1243:1,(arin1243:1,pump1237:1)arin1242:1)yeni1252:1;' \
+        in phylos.joinpath('glottolog_yeni1252', 'summary.trees').read_text(encoding='utf8')
+    assert 'isol1234:1,(kett1243' in \
+        phylos.joinpath('glottolog_global', 'summary.trees').read_text(encoding='utf8')
+    assert len(list(reader(phylos / 'glottolog_global' / 'taxa.csv'))) == 5
+    assert [(r['id'], r['year']) for r in reader(phylos / 'index.csv', dicts=True)] == \
+        [('glottolog_global', '2024'), ('glottolog_yeni1252', '2024'), ('x', '2000')]
+
+    files = {p: p.read_text(encoding='utf8') for p in phylos.glob('**/*.*')}
+    trees(
+        {gc: [] for gc in ['isol1234', 'kett1243', 'arin1243', 'pump1237']},
+        read_languoids(tests_dir / 'gl_repos'),
+        tmp_path,
+        '2024',
+        'Glottolog 5.0',
+        workers=2)
+    assert files == {p: p.read_text(encoding='utf8') for p in phylos.glob('**/*.*')}
+
+    trees({'kett1243': []}, read_languoids(tests_dir / 'gl_repos'), tmp_path, '2024', 'Glottolog')
+    assert 'glottolog_global = (kett1243:1);' in \
+        phylos.joinpath('glottolog_global', 'summary.trees').read_text(encoding='utf8')
@@ -0,0 +1,40 @@
+import tracemalloc
+
+from pydplace.profiling import Profiler, phase
+
+
+def test_Profiler(tmp_path):
+    with Profiler(cprofile='b') as profiler:
+        for _ in range(2):
+            with profiler.phase('a', rows=5):
+                with phase(profiler, 'b') as counts:
+                    counts['rows'] = 10
+        with phase(None, 'c') as counts:
+            counts['rows'] = 1
+    assert not tracemalloc.is_tracing()
+    report = profiler.report()
+    assert report['a']['rows'] == 10 and report['b']['rows'] == 20
+    assert report['a']['seconds'] >= report['b']['seconds']
+    assert report['a']['peak_memory'] > 0
+    assert 'c' not in report
+
+    profiler.write(tmp_path / 'profile.json', dataset='x')
+    assert tmp_path.joinpath('profile.json.prof').exists()
+
+
+def test_Profiler_peak_memory():
+    with Profiler() as profiler:
+        with profiler.phase('outer'):
+            with profiler.phase('big'):
+                data = bytearray(50 * 1024 * 1024)
+                del data
+            with profiler.phase('small'):
+                data = bytearray(1024)
+                del data
+        with profiler.phase('after'):
+            pass
+    report = profiler.report()
+    assert report['big']['peak_memory'] > 50 * 1024 * 1024
+    assert report['outer']['peak_memory'] >= report['big']['peak_memory']
+    assert report['small']['peak_memory'] < 10 * 1024 * 1024
+    assert report['after']['peak_memory'] < 10 * 1024 * 1024
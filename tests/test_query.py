@@ -0,0 +1,32 @@
+from cldfbench.dataset import dataset_from_module
+
+from pydplace.query import CrossDatasetIndex
+
+
+def test_CrossDatasetIndex(dataset_with_societies):
+    ds = dataset_from_module(dataset_with_societies)
+    index = CrossDatasetIndex([ds])
+    res = list(index.query('xd1431'))
+    assert {m.value['Soc_ID'] for m in res} == {'WNAI1'}
+    assert res[0].dataset == ds.id and res[0].xd_id == 'xd1431'
+    assert res[0].value['Source'].startswith('delaguna1960;')
+    assert res[0].value['source_coded_data'] == 'wn01.dat (World Cultures CD-ROM 2011, folder 10#2)'
+    assert len(list(index.query('xd1431', var_ids=['WNAI8', 'x']))) == 1
+    assert {r['Soc_ID'] for r in index[ds.id].values('xd1082')} == {'WNAI2'}
+    assert not list(index.query('xd0'))
+    assert not list(index.query('xd9999'))
+
+    res = list(index.batch([('xd1431', None), ('xd1082', ['WNAI8'])]))
+    assert {m.value['Soc_ID'] for m in res} == {'WNAI1', 'WNAI2'}
+
+    # The index is re-created when the data changes:
+    data = ds.cldf_dir / 'data.csv'
+    data.write_text(data.read_text(encoding='utf8').replace(',WNAI1,', ',WNAI2,'), encoding='utf8')
+    assert not list(CrossDatasetIndex([ds]).query('xd1431'))
+
+
+def test_CrossDatasetIndex_zipped(dataset_with_zipped_values):
+    ds = dataset_from_module(dataset_with_zipped_values)
+    res = list(CrossDatasetIndex([ds]).batch([('xd1431', None), ('xd1082', ['WNAI8'])]))
+    assert {m.value['Soc_ID'] for m in res} == {'WNAI1', 'WNAI2'}
+    assert res[0].value['source_coded_data'] == 'wn01.dat (World Cultures CD-ROM 2011, folder 10#2)'
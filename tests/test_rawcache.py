@@ -0,0 +1,29 @@
+import os
+
+from csvw import dsv
+
+from pydplace.rawcache import read_csv, iter_csv
+
+
+def test_read_csv(tmp_path, cache_dir):
+    p = tmp_path / 'test.csv'
+    p.write_text('a,b\n1,x\n2,x\n3,"y\nz"\n', encoding='utf8')
+    table = read_csv(p)
+    assert len(table) == 3
+    assert list(table.iterdicts()) == list(dsv.reader(p, dicts=True))
+    assert list(iter_csv(p, cache=True, start=1, end=2)) == [dict(a='2', b='x')]
+    assert list(iter_csv(p, start=1, end=2)) == [dict(a='2', b='x')]
+    assert len(list(cache_dir.joinpath('raw_csv').iterdir())) == 2
+
+    # Changed files are re-read, and the outdated cache is removed:
+    p.write_text('a,b\n1,x\n', encoding='utf8')
+    os.utime(p, ns=(1, 1))
+    assert len(read_csv(p)) == 1
+    assert len(read_csv(p)) == 1
+    assert len(list(cache_dir.joinpath('raw_csv').iterdir())) == 2
+
+    # Tables which cannot be cached are read with csvw:
+    for text in ['', 'a,b\n1,2,3\n']:
+        p.write_text(text, encoding='utf8')
+        assert read_csv(p) is None
+        assert list(iter_csv(p, cache=True)) == list(dsv.reader(p, dicts=True))
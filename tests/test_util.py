@@ -7,3 +7,16 @@ def test_remove_subdirs(tmpdir):
     assert tmpdir.join('a', 'b').check()
     remove_subdirs(str(tmpdir))
     assert not tmpdir.join('a').check()
+
+
+def test_csv_chunks(tmp_path):
+    p = tmp_path / 'test.csv'
+    p.write_bytes(b'a,b\n1,"x\ny"\n2,z\n3,"a ""quoted"" value"\n')
+    header, chunks = csv_chunks(p, 1)
+    assert header == b'a,b\n'
+    assert [p.read_bytes()[s:e] for s, e in chunks] == \
+        [b'1,"x\ny"\n', b'2,z\n', b'3,"a ""quoted"" value"\n']
+    assert len(csv_chunks(p, 100)[1]) == 1
+
+    p.write_bytes(b'')
+    assert csv_chunks(p, 1) == (b'', [])
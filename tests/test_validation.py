@@ -0,0 +1,158 @@
+import re
+import json
+import runpy
+import shutil
+import pathlib
+import zipfile
+
+import pytest
+
+from pydplace.dataset import DatasetWithSocieties, DatasetWithoutSocieties
+from pydplace.validation import Validator
+
+
+@pytest.fixture
+def ds(tmp_path):
+    shutil.copytree(pathlib.Path(__file__).parent / 'dataset_with_societies', tmp_path / 'ds')
+    for fname in ['map.png', '.zenodo.json']:
+        tmp_path.joinpath('ds', fname).write_text('')
+
+    class DS(DatasetWithSocieties):
+        id = 'dplace-dataset-test'
+        dir = tmp_path / 'ds'
+
+    return DS()
+
+
+def edit(p, *replacements):
+    text = p.read_text(encoding='utf8')
+    for old, new in replacements:
+        assert old in text
+        text = text.replace(old, new, 1)
+    p.write_text(text, encoding='utf8')
+
+
+def test_Validator(ds, mocker):
+    edit(ds.cldf_dir / 'StructureDataset-metadata.json', ('D-PLAC ', 'D-PLACE '))
+    validator = Validator(ds)
+    components = mocker.spy(validator, '_validate_components')
+    assert validator(), validator.errors
+    assert components.called
+    assert set(validator.timings) == {
+        'metadata', 'schema', 'read', 'row validators', 'keys', 'duplicate references',
+        'foreign keys', 'components', 'consistency'}
+
+    validator = Validator(ds, fast=True)
+    assert validator()
+    assert list(validator.timings) == ['metadata']
+
+    # Make sure the tests for new datasets pass:
+    shutil.copy(
+        pathlib.Path(__file__).parent.parent / 'src' / 'pydplace' / 'dataset_template' / 'test.py',
+        ds.dir)
+    runpy.run_path(str(ds.dir / 'test.py'))['test_dplace_check']()
+
+
+def test_Validator_sample(ds):
+    edit(
+        ds.cldf_dir / 'data.csv',
+        (',WNAI8,', ',XX,'),
+        ('\n5,', '\nx y,'))
+
+    def errors(**kw):
+        validator = Validator(ds, **kw)
+        assert not validator()
+        return validator.errors
+
+    assert 'data.csv:6:1 ID' in '\n'.join(errors(sample=100))
+    assert errors(sample=100) == errors()
+    assert len(errors(sample=1)) < len(errors())
+
+    # Sampling also works for zipped tables:
+    with zipfile.ZipFile(ds.cldf_dir / 'data.csv.zip', 'w') as zf:
+        zf.write(ds.cldf_dir / 'data.csv', 'data.csv')
+    all_errors = errors()
+    ds.cldf_dir.joinpath('data.csv').unlink()
+    assert errors(sample=100) == all_errors
+
+
+def test_Validator_errors(ds):
+    ds.id = 'test'
+    edit(
+        ds.cldf_dir / 'data.csv',
+        ('\n2,', '\n1,'),  # duplicate primary key
+        (',WNAI8,', ',XX,'),  # unknown Var_ID
+        ('swanton1908', 'nosuchsource'),  # unknown source
+        ('\n5,', '\nx y,'),  # invalid ID
+    )
+    with ds.cldf_dir.joinpath('data.csv').open('a', encoding='utf8') as f:
+        for i in range(100, 115):
+            f.write('{},YY,WNAI8,Northwest conifers,WNAI8-2,,,,,,\n'.format(i))
+    validator = Validator(ds)
+    assert not validator()
+    errors = '\n'.join(validator.errors)
+    # Missing foreign keys are reported with all rows:
+    assert re.search(r'data\.csv:(\d+,){10}\.\.\. \(\d+ rows\) YY not found', errors)
+    for s in [
+        'Invalid dataset ID',
+        'duplicate primary key',
+        'data.csv:2 XX not found in table variables.csv',
+        'missing source key: nosuchsource',
+        'data.csv:6:1 ID',
+    ]:
+        assert s in errors
+
+
+def test_Validator_schema_errors(ds):
+    edit(
+        ds.cldf_dir / 'StructureDataset-metadata.json',
+        ('"societies.csv"', '"x.csv"'),
+        ('"primaryKey": [\n                    "ID"', '"primaryKey": ["ID", "Value"'))
+    (ds.cldf_dir / 'codes.csv').unlink()
+    validator = Validator(ds)
+    assert not validator()
+    errors = '\n'.join(validator.errors)
+    assert 'Foreign key error' in errors
+    assert 'codes.csv does not exist' in errors
+    assert 'composite primary key' in validator.warnings[0]
+
+
+def test_Validator_consistency(ds):
+    edit(
+        ds.cldf_dir / 'data.csv',
+        (',WNAI12,Absent,WNAI12-1,', ',WNAI12,Absent,WNAI11-1,'))
+    edit(ds.cldf_dir / 'variables.csv', (',Ordinal,', ',Continuous,'))
+    with ds.cldf_dir.joinpath('data.csv').open('a', encoding='utf8') as f:
+        for i in range(100, 120):
+            f.write('{},WNAI1,WNAI11,1.5,WNAI11-1,,,,,,\n'.format(i))
+    validator = Validator(ds)
+    assert not validator()
+    errors = '\n'.join(validator.errors)
+    assert 'data.csv:8 Code_ID WNAI11-1 does not belong to Var_ID WNAI12' in errors
+    assert 'data.csv:5,6,7 non-numeric Value Absent for continuous variable' in errors
+    assert 'data.csv:5,6,7,14,15,16,17,18,19,20,... (23 rows) Code_ID WNAI11-1 for continuous ' \
+        'variable WNAI11' in errors
+
+
+def test_Validator_society_sets(tmp_path, ds):
+    shutil.copytree(
+        pathlib.Path(__file__).parent / 'dataset_without_societies', tmp_path / 'ds_without')
+
+    class DS(DatasetWithoutSocieties):
+        id = 'dplace-dataset-test'
+        dir = tmp_path / 'ds_without'
+
+    md = DS().cldf_dir / 'StructureDataset-metadata.json'
+    metadata = json.loads(md.read_text(encoding='utf8'))
+    metadata['dc:references'] = [str(ds.dir / 'cldfbench_test.py')]
+    md.write_text(json.dumps(metadata), encoding='utf8')
+    edit(DS().cldf_dir / 'data.csv', (',WNAI3,', ',WNAI4,'))
+    validator = Validator(DS())
+    validator()
+    assert 'data.csv:4 Soc_ID WNAI4 not found in referenced society sets' in validator.errors
+
+    metadata['dc:references'] = ['x']
+    md.write_text(json.dumps(metadata), encoding='utf8')
+    validator = Validator(DS())
+    validator()
+    assert 'Society set x not found' in validator.warnings[0]